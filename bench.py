@@ -1,183 +1,385 @@
+# -*- coding: utf-8 -*-
 """
-BEGIN:VCALENDAR
-VERSION:2.0
-PRODID:-//hacksw/handcal//NONSGML v1.0//EN
-BEGIN:VEVENT
-UID:uid1@example.com
-DTSTAMP:19970714T170000Z
-ORGANIZER;CN=John Doe:MAILTO:john.doe@example.com
-DTSTART:19970714T170000Z
-DTEND:19970715T035959Z
-SUMMARY:Bastille Day Party
-END:VEVENT
-END:VCALENDAR
+Benchmarks for llic.
+
+Runs a matrix of scenarios (event shape x output sink x event count) and
+reports events per second, octets per second and peak memory use for each.
+Results can be saved as JSON and compared against a saved baseline, in which
+case scenarios which have slowed down by more than a threshold are reported
+as regressions and the exit status is non-zero.
+
+Usage::
+
+    python bench.py --events 1000,100000,1000000 --output results.json
+    python bench.py --baseline results.json --threshold 0.1
+
+Run python bench.py --help for all options.
 """
+from __future__ import print_function, unicode_literals
+
+import argparse
 import datetime
+import json
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
-import icalendar
 import pytz
+import six
 
 import llic
 
+timer = getattr(time, "perf_counter", time.time)
+
+# The basic shape with a single event should generate exactly this
+EXAMPLE_ICAL = (
+    b"BEGIN:VCALENDAR\r\n"
+    b"VERSION:2.0\r\n"
+    b"PRODID:-//hacksw/handcal//NONSGML v1.0//EN\r\n"
+    b"BEGIN:VEVENT\r\n"
+    b"UID:uid1@example.com\r\n"
+    b"DTSTAMP:19970714T170000Z\r\n"
+    b"ORGANIZER;CN=John Doe:MAILTO:john.doe@example.com\r\n"
+    b"DTSTART:19970714T170000Z\r\n"
+    b"DTEND:19970715T035959Z\r\n"
+    b"SUMMARY:Bastille Day Party\r\n"
+    b"END:VEVENT\r\n"
+    b"END:VCALENDAR\r\n"
+)
+
+START = pytz.utc.localize(datetime.datetime(1997, 7, 14, 17, 0, 0))
+END = pytz.utc.localize(datetime.datetime(1997, 7, 15, 3, 59, 59))
+
+LONDON = pytz.timezone("Europe/London")
+LOCAL_START = LONDON.localize(datetime.datetime(1997, 7, 14, 18, 0, 0))
+
+DESCRIPTION = (
+    "This course introduces the fundamentals of the subject, including "
+    "its history; current practice, and open problems.\n" * 20
+)
+
+NON_ASCII_SUMMARY = (
+    "東京大学との共同セミナ"
+    "ー — r\xe9sum\xe9 des r\xe9sultats de l'\xe9t\xe9 " * 4
+)
+
+ATTENDEES = [
+    [("CN", "Attendee {}".format(i)), ("ROLE", "REQ-PARTICIPANT"),
+     ("PARTSTAT", "NEEDS-ACTION"), ("RSVP", "TRUE")]
+    for i in range(10)
+]
+
+
+def basic_event(writer, i):
+    writer.begin("VEVENT")
+    writer.contentline("UID", "uid{}@example.com".format(i + 1))
+    writer.contentline("DTSTAMP", writer.as_datetime(START))
+    writer.contentline("ORGANIZER", "MAILTO:john.doe@example.com",
+                       [("CN", "John Doe")])
+    writer.contentline("DTSTART", writer.as_datetime(START))
+    writer.contentline("DTEND", writer.as_datetime(END))
+    writer.contentline("SUMMARY", writer.as_text("Bastille Day Party"))
+    writer.end("VEVENT")
+
+
+def long_description_event(writer, i):
+    writer.begin("VEVENT")
+    writer.contentline("UID", "uid{}@example.com".format(i + 1))
+    writer.contentline("DTSTAMP", writer.as_datetime(START))
+    writer.contentline("SUMMARY", writer.as_text("Lecture {}".format(i)))
+    writer.contentline("DESCRIPTION", writer.as_text(DESCRIPTION))
+    writer.end("VEVENT")
+
+
+def non_ascii_event(writer, i):
+    writer.begin("VEVENT")
+    writer.contentline("UID", "uid{}@example.com".format(i + 1))
+    writer.contentline("DTSTAMP", writer.as_datetime(START))
+    writer.contentline("SUMMARY", writer.as_text(NON_ASCII_SUMMARY))
+    writer.end("VEVENT")
+
+
+def many_params_event(writer, i):
+    writer.begin("VEVENT")
+    writer.contentline("UID", "uid{}@example.com".format(i + 1))
+    writer.contentline("DTSTAMP", writer.as_datetime(START))
+    for n, params in enumerate(ATTENDEES):
+        writer.contentline(
+            "ATTENDEE", "MAILTO:attendee{}@example.com".format(n), params)
+    writer.end("VEVENT")
+
+
+def local_time_event(writer, i):
+    start = LOCAL_START + datetime.timedelta(minutes=i)
+    writer.begin("VEVENT")
+    writer.contentline("UID", "uid{}@example.com".format(i + 1))
+    writer.contentline("DTSTAMP", writer.as_datetime(START))
+    writer.contentline("DTSTART", writer.as_datetime(start))
+    writer.contentline("DTEND", writer.as_datetime(
+        start + datetime.timedelta(hours=1)))
+    writer.end("VEVENT")
+
+
+EXDATES = [START + datetime.timedelta(weeks=n) for n in range(0, 200, 2)]
+
+
+def recurring_event(writer, i):
+    writer.begin("VEVENT")
+    writer.contentline("UID", "uid{}@example.com".format(i + 1))
+    writer.contentline("DTSTAMP", writer.as_datetime(START))
+    writer.contentline("DTSTART", writer.as_datetime(START))
+    writer.contentline("DURATION", writer.as_duration(
+        datetime.timedelta(minutes=50)))
+    writer.contentline("RRULE", writer.as_recur(
+        "WEEKLY", count=200, byday=["MO", "TH"]))
+    writer.contentline("EXDATE", writer.as_list(EXDATES, writer.as_datetime))
+    writer.end("VEVENT")
+
+
+SHAPES = {
+    "basic": basic_event,
+    "long-description": long_description_event,
+    "non-ascii": non_ascii_event,
+    "many-params": many_params_event,
+    "local-time": local_time_event,
+    "recurring": recurring_event,
+}
+
+
+WRITERS = {
+    "default": llic.CalendarWriter,
+    "validating": llic.ValidatingCalendarWriter,
+    "instrumented": llic.InstrumentedCalendarWriter,
+}
+
+# The writer class used by the sinks, selected by --writer
+Writer = llic.CalendarWriter
+
+
+def write_calendar(writer, shape, event_count):
+    writer.begin("VCALENDAR")
+    writer.contentline("VERSION", "2.0")
+    writer.contentline("PRODID", "-//hacksw/handcal//NONSGML v1.0//EN")
+    for i in six.moves.range(event_count):
+        shape(writer, i)
+    writer.end("VCALENDAR")
+
+
+def render_bytesio(shape, event_count):
+    out = six.BytesIO()
+    write_calendar(Writer(out), shape, event_count)
+    return len(out.getvalue())
+
+
+def render_list(shape, event_count):
+    def render(writer):
+        write_calendar(writer, shape, event_count)
+    return sum(len(chunk)
+               for chunk in llic.iter_chunks(render, writer_class=Writer))
+
+
+def render_file(shape, event_count):
+    with tempfile.TemporaryFile() as f:
+        writer = Writer(f, buffer_size=llic.DEFAULT_CHUNK_SIZE)
+        write_calendar(writer, shape, event_count)
+        writer.flush()
+        return f.tell()
+
+
+def render_fd(shape, event_count):
+    with tempfile.TemporaryFile() as f:
+        out = llic.FileDescriptorOutput(f.fileno(), closefd=False)
+        write_calendar(Writer(out), shape, event_count)
+        out.flush()
+        return out.tell()
+
+
+class CountingOutput(object):
+    def __init__(self, output):
+        self.output = output
+        self.count = 0
 
-# We'll be generating this as a test
-EXAMPLE_ICAL = """\
-BEGIN:VCALENDAR\r\n\
-VERSION:2.0\r\n\
-PRODID:-//hacksw/handcal//NONSGML v1.0//EN\r\n\
-BEGIN:VEVENT\r\n\
-UID:uid1@example.com\r\n\
-DTSTAMP:19970714T170000Z\r\n\
-ORGANIZER;CN=John Doe:MAILTO:john.doe@example.com\r\n\
-DTSTART:19970714T170000Z\r\n\
-DTEND:19970715T035959Z\r\n\
-SUMMARY:Bastille Day Party\r\n\
-END:VEVENT\r\n\
-END:VCALENDAR\r\n\
-"""
-
+    def write(self, octets):
+        self.output.write(octets)
+        self.count += len(octets)
 
-class ICalendarGenerator(object):
-    def generate_icalendar(self):
-        raise NotImplemented
 
-    def self_test(self):
-        """
-        Verify that generate_icalendar() generates the expected iCal.
-        """
-        cal = self.generate_icalendar(1)
-        actual = icalendar.Calendar.from_ical(cal).to_ical()
-        expected = icalendar.Calendar.from_ical(EXAMPLE_ICAL).to_ical()
+def render_gzip(shape, event_count):
+    with tempfile.TemporaryFile() as f:
+        out = CountingOutput(f)
+        writer = Writer(llic.CompressedOutput(out),
+                        buffer_size=llic.DEFAULT_CHUNK_SIZE)
+        write_calendar(writer, shape, event_count)
+        writer.close()
+        return out.count
 
-        if not actual == expected:
-            print cal
-            print actual
-            print expected
-            raise AssertionError("Generated calendar didn't match example.",
-                                 actual, expected)
 
+# Each sink renders a calendar and returns the number of octets output
+SINKS = {
+    "bytesio": render_bytesio,
+    "list": render_list,
+    "file": render_file,
+    "fd": render_fd,
+    "gzip": render_gzip,
+}
 
-class DodgyIO():
+
+def self_test():
+    """
+    Verify that the basic shape generates the example calendar.
+    """
+    out = six.BytesIO()
+    write_calendar(Writer(out), basic_event, 1)
+    if out.getvalue() != EXAMPLE_ICAL:
+        raise AssertionError("Generated calendar didn't match example.",
+                             out.getvalue(), EXAMPLE_ICAL)
+
+
+def measure_peak_memory(sink, shape, event_count):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        sink(shape, event_count)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(shape_name, sink_name, event_count, repeat, memory,
+                 writer_name="default"):
+    shape, sink = SHAPES[shape_name], SINKS[sink_name]
+    scenario = "{}/{}/{}".format(shape_name, sink_name, event_count)
+    if writer_name != "default":
+        scenario += "/" + writer_name
+
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        octets = sink(shape, event_count)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        "scenario": scenario,
+        "events": event_count,
+        "octets": octets,
+        "seconds": best,
+        "events_per_second": event_count / best,
+        "octets_per_second": octets / best,
+        "peak_memory": (measure_peak_memory(sink, shape, event_count)
+                        if memory else None),
+    }
+
+
+def compare(results, baseline, threshold):
     """
-    A very simple file like object. Seems faster than [c]StringIO these
-    examples at least...
+    Get the results which are slower than their baseline result by more
+    than threshold (a fraction), as (result, baseline_result) pairs.
     """
-    def __init__(self):
-        self.bits = []
-
-    def write(self, string):
-        self.bits.append(string)
-
-    def getvalue(self):
-        return "".join(self.bits)
-
-    def close(self):
-        self.bits = None
-
-
-class LlicICalendarGenerator(ICalendarGenerator):
-    def generate_icalendar(self, event_count=1):
-        out = DodgyIO()
-        cw = llic.CalendarWriter(out)
-
-        start = pytz.utc.localize(
-            datetime.datetime(1997, 7, 14, 17, 0, 0))
-        end = pytz.utc.localize(
-            datetime.datetime(1997, 7, 15, 3, 59, 59))
-
-        cw.begin("VCALENDAR")
-        cw.contentline("VERSION", "2.0")
-        cw.contentline("PRODID", "-//hacksw/handcal//NONSGML v1.0//EN")
-        for i in xrange(event_count):
-            cw.begin("VEVENT")
-            cw.contentline("UID", "uid{}@example.com".format(i + 1))
-            cw.contentline("DTSTAMP", cw.as_datetime(start))
-            cw.contentline("ORGANIZER;CN=John Doe",
-                           "MAILTO:john.doe@example.com")
-            cw.contentline("DTSTART", cw.as_datetime(start))
-            cw.contentline("DTEND", cw.as_datetime(end))
-            cw.contentline("SUMMARY", cw.as_text("Bastille Day Party"))
-            cw.end("VEVENT")
-        cw.end("VCALENDAR")
-
-        result = out.getvalue()
-        out.close()
-        return result
-
-
-class ICalendarICalendarGenerator(ICalendarGenerator):
-    def generate_icalendar(self, event_count=1):
-        calendar = icalendar.Calendar()
-        calendar.add("VERSION", "2.0")
-        calendar.add("PRODID", "-//hacksw/handcal//NONSGML v1.0//EN")
-
-        start = pytz.utc.localize(
-            datetime.datetime(1997, 7, 14, 17, 0, 0))
-        end = pytz.utc.localize(
-            datetime.datetime(1997, 7, 15, 3, 59, 59))
-
-        for i in xrange(event_count):
-            event = icalendar.Event()
-            event.add("UID", "uid{}@example.com".format(i + 1))
-            event.add("DTSTAMP", start)
-
-            organiser = icalendar.vCalAddress("MAILTO:john.doe@example.com")
-            organiser.params["CN"] = "John Doe"
-            event.add("ORGANIZER", organiser)
-
-            event.add("DTSTART", start)
-            event.add("DTEND", end)
-
-            event.add("SUMMARY", "Bastille Day Party")
-
-            # To generate exactly the iCal text we want we need to remove
-            # some auto-generated properties from the dates
-            event["DTSTAMP"].params.clear()
-            event["DTSTART"].params.clear()
-            event["DTEND"].params.clear()
-
-            calendar.add_component(event)
-
-        return calendar.to_ical()
-
-
-class StupidICalendarGenerator(ICalendarGenerator):
-    def generate_icalendar(self, event_count=1):
-        bits = []
-        start = (
-            "BEGIN:VCALENDAR\r\n"
-            "VERSION:2.0\r\n"
-            "PRODID:-//hacksw/handcal//NONSGML v1.0//EN\r\n"
-        )
-        bits.append(start)
-
-        for i in xrange(event_count):
-            event = (
-                "BEGIN:VEVENT\r\n"
-                "UID:uid" + str(i + 1) + "@example.com\r\n"
-                "DTSTAMP:19970714T170000Z\r\n"
-                "ORGANIZER;CN=John Doe:MAILTO:john.doe@example.com\r\n"
-                "DTSTART:19970714T170000Z\r\n"
-                "DTEND:19970715T035959Z\r\n"
-                "SUMMARY:Bastille Day Party\r\n"
-                "END:VEVENT\r\n"
-            )
-            bits.append(event)
-
-        end = (
-            "END:VCALENDAR\r\n"
-        )
-        bits.append(end)
-        return "".join(bits)
-
-
-llic_gen = LlicICalendarGenerator()
-ical_gen = ICalendarICalendarGenerator()
-stupid_gen = StupidICalendarGenerator()
-
-
-def self_test_all():
-    llic_gen.self_test()
-    ical_gen.self_test()
-    stupid_gen.self_test()
-    print("Self test: OK")
+    baseline_results = dict(
+        (r["scenario"], r) for r in baseline["results"])
+    regressions = []
+    for result in results:
+        base = baseline_results.get(result["scenario"])
+        if base is None:
+            continue
+        limit = base["events_per_second"] * (1 - threshold)
+        if result["events_per_second"] < limit:
+            regressions.append((result, base))
+    return regressions
+
+
+def format_result(result):
+    memory = result["peak_memory"]
+    return "{:<36} {:>12,.0f} events/s {:>8.2f} MB/s {:>10} peak".format(
+        result["scenario"], result["events_per_second"],
+        result["octets_per_second"] / 1e6,
+        "-" if memory is None else "{:.1f} MB".format(memory / 1e6))
+
+
+def comma_list(choices=None):
+    def parse(value):
+        values = [v.strip() for v in value.split(",") if v.strip()]
+        if choices is not None:
+            for v in values:
+                if v not in choices:
+                    raise argparse.ArgumentTypeError(
+                        "{!r} is not one of: {}".format(
+                            v, ", ".join(sorted(choices))))
+        return values
+    return parse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark llic calendar generation.")
+    parser.add_argument(
+        "--shapes", type=comma_list(SHAPES), default=sorted(SHAPES),
+        help="Comma separated event shapes (default: all)")
+    parser.add_argument(
+        "--sinks", type=comma_list(SINKS), default=sorted(SINKS),
+        help="Comma separated output sinks (default: all)")
+    parser.add_argument(
+        "--events", type=comma_list(), default=["1000", "100000"],
+        help="Comma separated event counts (default: 1000,100000)")
+    parser.add_argument(
+        "--writer", choices=sorted(WRITERS), default="default",
+        help="The CalendarWriter class to benchmark (default: default)")
+    parser.add_argument(
+        "--repeat", type=int, default=3,
+        help="Runs per scenario; the fastest is reported (default: 3)")
+    parser.add_argument(
+        "--no-memory", dest="memory", action="store_false",
+        help="Don't measure peak memory use")
+    parser.add_argument(
+        "--output", help="Write results to this JSON file")
+    parser.add_argument(
+        "--baseline", help="Compare results with this JSON results file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1,
+        help="Fractional slowdown reported as a regression (default: 0.1)")
+    args = parser.parse_args(argv)
+
+    global Writer
+    Writer = WRITERS[args.writer]
+    self_test()
+
+    results = []
+    for event_count in [int(n) for n in args.events]:
+        for shape_name in args.shapes:
+            for sink_name in args.sinks:
+                result = run_scenario(shape_name, sink_name, event_count,
+                                      args.repeat, args.memory, args.writer)
+                print(format_result(result))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "llic": llic.__version__,
+                "results": results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for result, base in regressions:
+            print("REGRESSION {}: {:,.0f} events/s, baseline {:,.0f}".format(
+                result["scenario"], result["events_per_second"],
+                base["events_per_second"]))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,24 @@
 """
 Low-Level iCalendar library.
 """
-from __future__ import unicode_literals
+from __future__ import print_function, unicode_literals
+
+import base64
+import bisect
+import calendar
+import collections
+import datetime
+import errno
+import hashlib
+import itertools
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import time
+import zlib
 
 import pytz
 import six
@@ -17,13 +34,213 @@ CRLF_WRAP = b"\r\n "
 
 NAME_VALUE_SEPARATOR = b":"
 
+PARAM_SEPARATOR = b";"
+
+PARAM_NAME_VALUE_SEPARATOR = b"="
+
+DEFAULT_PARAM_CACHE_SIZE = 256
+
+# Two digit, zero padded encodings of 0-99, used to format dates and times
+# without going through strftime().
+_DIGITS = tuple(("%02d" % n).encode("ascii") for n in range(100))
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+_ZERO_DURATION = datetime.timedelta(0)
+
+_clock = getattr(time, "perf_counter", time.time)
+
+DEFAULT_READ_SIZE = 64 * 1024
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+DEFAULT_BATCH_SIZE = 1000
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+# The maximum number of buffers passed to os.writev(), which may not exceed
+# the system's IOV_MAX
+DEFAULT_MAX_IOVECS = 1024
+
+DEFAULT_VTIMEZONE_CACHE_SIZE = 128
+
+DEFAULT_COMPONENT_CACHE_SIZE = 10000
+
+DEFAULT_HASH_ALGORITHM = "sha256"
+
+# The number of octets of binary values base64 encoded at a time. The
+# encoder rounds it to fill a whole number of folded lines.
+DEFAULT_BINARY_BLOCK_SIZE = 48 * 1024
+
+# The DTSTART of the first observance of a timezone, which pytz begins at
+# datetime.min. Clients conventionally use the start of the Gregorian
+# calendar's first 400 year cycle.
+_FIRST_OBSERVANCE_START = datetime.datetime(1601, 1, 1)
+
+# pytz's transition tables stop in this year, so the transitions of
+# timezones which still observe daylight saving time are continued with
+# RRULEs, from the POSIX TZ string at the end of the TZif file, after it.
+_LAST_TRANSITION_YEAR = 2037
+
+# RECUR weekday names, indexed by datetime.weekday()
+_WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+# A POSIX TZ string rule of the nth (or 5th meaning last) weekday of a
+# month, and an optional local time of day
+_POSIX_TZ_RULE_RE = re.compile(
+    r"M(\d+)\.([1-5])\.([0-6])(?:/([-+]?)(\d+)(?::(\d+))?(?::(\d+))?)?$")
+
+# zlib window bits values selecting the compressed format's container
+_COMPRESSION_WBITS = {
+    "gzip": 16 + zlib.MAX_WBITS,
+    "deflate": zlib.MAX_WBITS,
+    "raw": -zlib.MAX_WBITS
+}
+
+
+_MISSING = object()
+
+# Control characters can't occur in parameter values. \n is handled by
+# RFC 6868 escaping and \t is allowed.
+_PARAM_DELETE_CHARS = b"".join(
+    six.int2byte(c) for c in range(0x0, 0x20) if c not in (0x09, 0x0A)
+) + b"\x7f"
+
+_PARAM_QUOTE_CHARS = re.compile(b"[:;,]")
+
+
+def encode_param_value(value):
+    """
+    Encode a property parameter value.
+
+    Values containing ":", ";" or "," are quoted. Characters which can't
+    appear in a quoted value are escaped as described by RFC 6868. A list
+    or tuple of values is encoded as a multi-valued parameter.
+    """
+    if isinstance(value, (list, tuple)):
+        return b",".join(encode_param_value(v) for v in value)
+
+    if isinstance(value, six.text_type):
+        value = value.encode("utf-8")
+
+    if b"^" in value:
+        value = value.replace(b"^", b"^^")
+    if b"\n" in value:
+        value = value.replace(b"\n", b"^n")
+    if b'"' in value:
+        value = value.replace(b'"', b"^'")
+    value = value.translate(None, _PARAM_DELETE_CHARS)
+
+    if _PARAM_QUOTE_CHARS.search(value) is not None:
+        return b'"' + value + b'"'
+    return value
+
+
+def encode_contentline_prefix(name, params):
+    """
+    Encode the part of a content line preceding the value:
+    NAME;PARAM=VALUE;...:
+
+    params is a mapping or a sequence of (name, value) pairs.
+    """
+    if isinstance(name, six.text_type):
+        name = name.encode("utf-8")
+
+    if hasattr(params, "items"):
+        params = params.items()
+
+    parts = [name]
+    for param_name, param_value in params:
+        if isinstance(param_name, six.text_type):
+            param_name = param_name.encode("utf-8")
+        parts.append(PARAM_SEPARATOR)
+        parts.append(param_name)
+        parts.append(PARAM_NAME_VALUE_SEPARATOR)
+        parts.append(encode_param_value(param_value))
+    parts.append(NAME_VALUE_SEPARATOR)
+    return b"".join(parts)
+
+
+class LRUCache(object):
+    """
+    A mapping holding at most maxsize items, discarding the least recently
+    used item when full. Counts the hits and misses of get().
+    """
+
+    def __init__(self, maxsize=1024):
+        if maxsize < 1:
+            raise ValueError(
+                "maxsize must be positive, got: {!r}".format(maxsize))
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        items = self._items
+        value = items.pop(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        # Re-insert to mark as most recently used
+        items[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        items = self._items
+        items.pop(key, None)
+        items[key] = value
+        if len(items) > self.maxsize:
+            items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
 
 class BaseCalendarWriter(object):
+    """
+    Writes iCalendar content lines to a file-like output, folding lines
+    which would exceed line_length octets.
 
-    def __init__(self, output, line_length=DEFAULT_ICAL_LINE_LENGTH):
+    By default every fragment is passed straight to output.write(). If
+    buffer_size is given, fragments are collected in an internal buffer
+    which is written to the output in one go whenever it holds at least
+    buffer_size octets at the end of a line. Buffered writers must be
+    flushed (or closed) once writing is complete.
+    """
+
+    def __init__(self, output, line_length=DEFAULT_ICAL_LINE_LENGTH,
+                 buffer_size=None, param_cache=None):
         self.output = output
         self.line_length = line_length
         self.line_position = 0
+        self.buffer_size = buffer_size
+
+        if param_cache is None:
+            param_cache = LRUCache(DEFAULT_PARAM_CACHE_SIZE)
+        self.param_cache = param_cache
+
+        if buffer_size is None:
+            self._buffer = None
+            self._write = output.write
+        else:
+            if buffer_size < 1:
+                raise ValueError(
+                    "buffer_size must be positive, got: {!r}"
+                    .format(buffer_size))
+            self._buffer = bytearray()
+            self._write = self._buffer.extend
 
     def write(self, octets):
         assert self.line_position <= self.line_length
@@ -36,34 +253,173 @@ class BaseCalendarWriter(object):
 
         octets_len = len(octets)
         if octets_len + self.line_position <= self.line_length:
-            self.output.write(octets)
+            self._write(octets)
             self.line_position += octets_len
         else:
             self.__wrap_write(octets)
 
     def __wrap_write(self, octets):
-        out = self.output
+        write = self._write
+        indexbytes = six.indexbytes
+        line_length = self.line_length
+        position = self.line_position
+        octets_len = len(octets)
+        start = 0
+
         while True:
-            write_count = self.line_length - self.line_position
-            out.write(octets[:write_count])
-            octets = octets[write_count:]
-            if octets:
-                self.endline(True)
-            else:
-                break
+            cut = start + line_length - position
+            if cut >= octets_len:
+                write(octets[start:] if start else octets)
+                self.line_position = position + octets_len - start
+                return
+
+            # Don't fold in the middle of a multi-octet UTF-8 sequence. The
+            # cut is moved back over at most 3 continuation octets to the
+            # start of the sequence.
+            boundary = cut
+            limit = max(start, cut - 3)
+            while (boundary > limit and
+                   indexbytes(octets, boundary) & 0xC0 == 0x80):
+                boundary -= 1
+            if (indexbytes(octets, boundary) & 0xC0 == 0x80 or
+                    (boundary == start and position <= 1)):
+                # Not UTF-8, or not even one character fits on an empty
+                # line, so fold at the octet limit.
+                boundary = cut
+
+            if boundary > start:
+                write(octets[start:boundary])
+                start = boundary
+            self.endline(True)
+            position = self.line_position
 
     def endline(self, is_wrapping):
-        out = self.output
+        write = self._write
         if is_wrapping:
-            out.write(CRLF_WRAP)
+            write(CRLF_WRAP)
             self.line_position = 1
         else:
-            out.write(CRLF)
+            write(CRLF)
             self.line_position = 0
 
-    def start_contentline(self, name):
-        self.write(name)
-        self.write(NAME_VALUE_SEPARATOR)
+        buffer = self._buffer
+        if buffer is not None and len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write any buffered octets to the output.
+        """
+        buffer = self._buffer
+        if buffer:
+            self.output.write(bytes(buffer))
+            del buffer[:]
+
+    def close(self):
+        """
+        Flush any buffered octets and close the output.
+        """
+        self.flush()
+        close = getattr(self.output, "close", None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_raw(self, octets, line_position=0):
+        """
+        Write octets which have already been folded, bypassing line
+        folding. line_position is the position on the current line after
+        the octets have been written; the default of 0 is correct for
+        octets containing complete content lines.
+        """
+        self._write(octets)
+        self.line_position = line_position
+
+        buffer = self._buffer
+        if buffer is not None and len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def tell(self):
+        """
+        Get the offset in the output of the next octet to be written.
+        The output must have a tell() method.
+        """
+        position = self.output.tell()
+        if self._buffer is not None:
+            position += len(self._buffer)
+        return position
+
+    def write_file(self, f, offset=0, count=None):
+        """
+        Write count octets (by default, all) of a file from offset. The
+        octets must be complete, folded content lines, e.g. a component
+        located in a file with an IndexedCalendar.
+
+        Outputs with a sendfile() method, such as FileDescriptorOutput,
+        copy the file without reading it into memory.
+        """
+        assert self.line_position == 0
+        sendfile = getattr(self.output, "sendfile", None)
+        if sendfile is not None:
+            self.flush()
+            sendfile(f, offset, count)
+            return
+
+        f.seek(offset)
+        while count is None or count > 0:
+            size = DEFAULT_READ_SIZE
+            if count is not None:
+                size = min(size, count)
+                count -= size
+            octets = f.read(size)
+            if not octets:
+                break
+            self.write_raw(octets)
+
+    def capture(self, render, *args):
+        """
+        Call render(self, *args) and return the octets it writes instead
+        of writing them to the output. render must write complete content
+        lines.
+        """
+        assert self.line_position == 0
+        write, buffer = self._write, self._buffer
+        captured = bytearray()
+        self._write = captured.extend
+        # Nothing is flushed while capturing
+        self._buffer = None
+        try:
+            render(self, *args)
+        finally:
+            self._write, self._buffer = write, buffer
+        return bytes(captured)
+
+    def start_contentline(self, name, params=None):
+        if params:
+            self.write(self._contentline_prefix(name, params))
+        else:
+            self.write(name)
+            self.write(NAME_VALUE_SEPARATOR)
+
+    def _contentline_prefix(self, name, params):
+        if hasattr(params, "items"):
+            params = params.items()
+        key = (name, tuple(params))
+        try:
+            prefix = self.param_cache.get(key)
+        except TypeError:
+            # Unhashable (e.g. list) parameter values aren't cached
+            return encode_contentline_prefix(name, key[1])
+
+        if prefix is None:
+            prefix = encode_contentline_prefix(name, key[1])
+            self.param_cache[key] = prefix
+        return prefix
 
     def value(self, value):
         self.write(value)
@@ -73,6 +429,14 @@ class BaseCalendarWriter(object):
 
 
 class TypesCalendarWriterHelperMixin(object):
+    """
+    Methods to encode Python values as iCalendar property values.
+    """
+
+    # The maximum number of encoded datetimes to remember. DTSTAMP values
+    # in particular tend to be repeated throughout a calendar.
+    datetime_cache_size = 128
+
     # The following range of chars cannot occur in iCalendar TEXT, so we
     # just delete them.
     text_delete_chars = b"".join(
@@ -80,10 +444,32 @@ class TypesCalendarWriterHelperMixin(object):
         if c != ord(b"\n")  # Ignore \n as it's handled by escaping)
     )
 
+    def __init__(self, *args, **kwargs):
+        text_cache = kwargs.pop("text_cache", None)
+        super(TypesCalendarWriterHelperMixin, self).__init__(*args, **kwargs)
+        self.text_cache = text_cache
+        self._datetime_cache = {}
+        # Maps the name of each timezone used by as_local_datetime() to
+        # the (first, last) years it was used for.
+        self.timezone_years = {}
+
     def as_text(self, text):
         """
         Encode text as an iCalendar TEXT value.
+
+        If the writer has a text_cache (an LRUCache) encoded values are
+        looked up in and stored in it.
         """
+        cache = self.text_cache
+        if cache is not None:
+            encoded = cache.get(text)
+            if encoded is None:
+                encoded = self._escape_text(text)
+                cache[text] = encoded
+            return encoded
+        return self._escape_text(text)
+
+    def _escape_text(self, text):
         if isinstance(text, six.text_type):
             text = text.encode("utf-8")
 
@@ -103,29 +489,2487 @@ class TypesCalendarWriterHelperMixin(object):
         """
         Encode a datetime object as an iCalendar DATETIME in UTC.
         """
+        cache = self._datetime_cache
+        try:
+            return cache[dt]
+        except KeyError:
+            pass
+
         if dt.tzinfo is None:
             raise ValueError("dt must have a tzinfo, got: {!r}".format(dt))
 
         if dt.tzinfo != pytz.utc:
-            dt = dt.astimezone(pytz.utc)
-        return dt.strftime("%Y%m%dT%H%M%SZ")
+            utc = dt.astimezone(pytz.utc)
+        else:
+            utc = dt
+
+        d = _DIGITS
+        year = utc.year
+        encoded = b"".join((
+            d[year // 100], d[year % 100], d[utc.month], d[utc.day], b"T",
+            d[utc.hour], d[utc.minute], d[utc.second], b"Z"))
+
+        if len(cache) >= self.datetime_cache_size:
+            cache.clear()
+        cache[dt] = encoded
+        return encoded
+
+    def as_date(self, date):
+        """
+        Encode a date object as an iCalendar DATE.
+        """
+        d = _DIGITS
+        year = date.year
+        return b"".join((
+            d[year // 100], d[year % 100], d[date.month], d[date.day]))
+
+    def as_duration(self, duration):
+        """
+        Encode a timedelta as an iCalendar DURATION. Microseconds are
+        ignored.
+        """
+        if duration < _ZERO_DURATION:
+            return b"-" + self.as_duration(-duration)
+
+        days, seconds = duration.days, duration.seconds
+        if not seconds:
+            if not days:
+                return b"PT0S"
+            if not days % 7:
+                return b"P" + str(days // 7).encode("ascii") + b"W"
+
+        parts = [b"P"]
+        if days:
+            parts.append(str(days).encode("ascii") + b"D")
+        if seconds:
+            minutes, second = divmod(seconds, 60)
+            hour, minute = divmod(minutes, 60)
+            parts.append(b"T")
+            if hour:
+                parts.append(str(hour).encode("ascii") + b"H")
+            if minute:
+                parts.append(str(minute).encode("ascii") + b"M")
+            if second:
+                parts.append(str(second).encode("ascii") + b"S")
+        return b"".join(parts)
+
+    def as_period(self, start, end):
+        """
+        Encode an iCalendar PERIOD starting at the datetime start. end is
+        either a datetime or a timedelta giving the period's duration.
+        """
+        if isinstance(end, datetime.timedelta):
+            encoded_end = self.as_duration(end)
+        else:
+            encoded_end = self.as_datetime(end)
+        return self.as_datetime(start) + b"/" + encoded_end
+
+    def as_recur(self, freq, until=None, count=None, interval=None,
+                 **parts):
+        """
+        Encode an iCalendar RECUR value (as used by RRULE).
+
+        until is a date or datetime, and can't be given with count. Other
+        rule parts are given as keyword arguments named after the part, for
+        example byday=["MO", "WE"] or bymonthday=1. Values may be strings,
+        bytes, integers or sequences of them.
+        """
+        if until is not None and count is not None:
+            raise ValueError("until and count can't both be given")
+
+        if isinstance(freq, six.text_type):
+            freq = freq.encode("ascii")
+        encoded = [b"FREQ=" + freq.upper()]
+        if until is not None:
+            if isinstance(until, datetime.datetime):
+                encoded.append(b"UNTIL=" + self.as_datetime(until))
+            else:
+                encoded.append(b"UNTIL=" + self.as_date(until))
+        if count is not None:
+            encoded.append(b"COUNT=" + str(count).encode("ascii"))
+        if interval is not None:
+            encoded.append(b"INTERVAL=" + str(interval).encode("ascii"))
+        for name, value in sorted(parts.items()):
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            encoded.append(
+                name.upper().encode("ascii") + b"=" + b",".join(
+                    v if isinstance(v, bytes)
+                    else six.text_type(v).encode("ascii") for v in value))
+        return b";".join(encoded)
+
+    def as_list(self, values, encoder=None):
+        """
+        Encode a multi-valued property value (e.g. for EXDATE, RDATE or
+        CATEGORIES) by joining values with commas. encoder is applied to
+        each value if given, e.g. writer.as_list(dates, writer.as_date).
+        """
+        if encoder is None:
+            return b",".join(
+                v.encode("utf-8") if isinstance(v, six.text_type) else v
+                for v in values)
+        return b",".join(map(encoder, values))
+
+    def as_local_datetime(self, dt):
+        """
+        Encode a datetime object as an iCalendar DATETIME in its own
+        timezone, which must be a pytz timezone. The value must be written
+        with a TZID parameter naming the timezone, and the calendar must
+        include a VTIMEZONE for it (see vtimezones()).
+        """
+        zone = getattr(dt.tzinfo, "zone", None)
+        if zone is None:
+            raise ValueError(
+                "dt must have a pytz timezone, got: {!r}".format(dt))
+
+        year = dt.year
+        years = self.timezone_years.get(zone)
+        if years is None:
+            self.timezone_years[zone] = (year, year)
+        elif not years[0] <= year <= years[1]:
+            self.timezone_years[zone] = (
+                min(year, years[0]), max(year, years[1]))
+
+        d = _DIGITS
+        return b"".join((
+            d[year // 100], d[year % 100], d[dt.month], d[dt.day], b"T",
+            d[dt.hour], d[dt.minute], d[dt.second]))
+
+    def as_timestamp(self, timestamp):
+        """
+        Encode a POSIX timestamp (seconds since the epoch) as an iCalendar
+        DATETIME in UTC.
+        """
+        cache = self._datetime_cache
+        try:
+            return cache[timestamp]
+        except KeyError:
+            pass
+
+        days, seconds = divmod(int(timestamp), _SECONDS_PER_DAY)
+        date = datetime.date.fromordinal(_EPOCH_ORDINAL + days)
+        minutes, second = divmod(seconds, 60)
+        hour, minute = divmod(minutes, 60)
+
+        d = _DIGITS
+        year = date.year
+        encoded = b"".join((
+            d[year // 100], d[year % 100], d[date.month], d[date.day], b"T",
+            d[hour], d[minute], d[second], b"Z"))
+
+        if len(cache) >= self.datetime_cache_size:
+            cache.clear()
+        cache[timestamp] = encoded
+        return encoded
 
 
 class CalendarWriterHelperMixin(object):
 
-    def contentline(self, name, value):
-        self.start_contentline(name)
+    def contentline(self, name, value, params=None):
+        """
+        Write a complete content line. params is an optional mapping or
+        sequence of (name, value) pairs of property parameters.
+        """
+        if params is None:
+            # Subclasses may override start_contentline(self, name)
+            self.start_contentline(name)
+        else:
+            self.start_contentline(name, params)
         self.value(value)
         self.end_contentline()
 
+    def datetime_contentline(self, name, dt, params=None):
+        """
+        Write a DATE-TIME property in dt's timezone, with a TZID parameter
+        naming it. dt is written in UTC if its timezone is UTC or isn't a
+        pytz timezone.
+        """
+        zone = getattr(dt.tzinfo, "zone", None)
+        if zone is None or zone == "UTC":
+            self.contentline(name, self.as_datetime(dt), params)
+            return
+
+        tzid = [("TZID", zone)]
+        if params:
+            if hasattr(params, "items"):
+                params = params.items()
+            tzid.extend(params)
+        self.contentline(name, self.as_local_datetime(dt), tzid)
+
+    def vtimezone(self, zone, first_year, last_year):
+        """
+        Write a VTIMEZONE component for zone (a pytz timezone or its name)
+        covering first_year to last_year inclusive.
+        """
+        assert self.line_position == 0
+        self.write_raw(encode_vtimezone(
+            zone, first_year, last_year, self.line_length))
+
+    def vtimezones(self):
+        """
+        Write a VTIMEZONE component for each timezone used by
+        as_local_datetime() so far, covering the years it was used for.
+        """
+        for zone, (first_year, last_year) in sorted(
+                self.timezone_years.items()):
+            self.vtimezone(zone, first_year, last_year)
+
+    def render_cached(self, cache, key, render, *args):
+        """
+        Write a component rendered by render(self, *args), using the
+        octets stored under key in cache (a ComponentCache) if present.
+        Otherwise the octets render writes are stored in the cache.
+
+        key must change whenever the component does, e.g. (UID, SEQUENCE)
+        or (UID, LAST-MODIFIED). render is only called on a cache miss, so
+        it shouldn't have other side effects: in particular timezones used
+        by cached components aren't recorded for vtimezones().
+        """
+        octets = cache.get(key)
+        if octets is None:
+            octets = self.capture(render, *args)
+            cache[key] = octets
+        self.write_raw(octets)
+
+    def indexed(self, index, uid):
+        """
+        Return a context manager which records the offset and length of
+        the octets written inside it in index (a ComponentIndex) under
+        uid::
+
+            with writer.indexed(index, uid):
+                writer.render(template, uid, summary)
+        """
+        return _Indexed(self, index, uid)
+
+    def binary_contentline(self, name, data, params=None,
+                           block_size=DEFAULT_BINARY_BLOCK_SIZE):
+        """
+        Write a property with an inline BINARY value (e.g. ATTACH), base64
+        encoded from data, which is bytes, a binary file-like object or an
+        iterable of bytes. params are written after the ENCODING=BASE64
+        and VALUE=BINARY parameters.
+
+        data is read and encoded block_size octets at a time, so memory use
+        doesn't depend on the size of data.
+        """
+        binary_params = [("ENCODING", "BASE64"), ("VALUE", "BINARY")]
+        if params:
+            if hasattr(params, "items"):
+                params = params.items()
+            binary_params.extend(params)
+        self.start_contentline(name, binary_params)
+        self.binary_value(data, block_size)
+        self.end_contentline()
+
+    def binary_value(self, data, block_size=DEFAULT_BINARY_BLOCK_SIZE):
+        """
+        Write data as a base64 encoded value in blocks; see
+        binary_contentline().
+        """
+        # Blocks encode to a whole number of continuation lines, so every
+        # block after the first is folded identically.
+        line_octets = max(self.line_length - 1, 1) * 3
+        block_size = max(1, block_size // line_octets) * line_octets
+
+        value = self.value
+        b64encode = base64.b64encode
+        wrote_value = False
+        for block in _iter_blocks(data, block_size):
+            value(b64encode(block))
+            wrote_value = True
+        if not wrote_value:
+            value(b"")
+
     def begin(self, section):
         self.contentline("BEGIN", section)
 
     def end(self, section):
         self.contentline("END", section)
 
+    def render(self, template, *values):
+        """
+        Write a component from a ComponentTemplate, filling its slots
+        with values in the order the slots were declared.
+        """
+        segments, tail = template.compile(self.line_length)
+        if len(values) != len(segments):
+            raise ValueError("{!r} has {} slots, got {} values".format(
+                template, len(segments), len(values)))
+
+        assert self.line_position == 0
+
+        write_raw = self.write_raw
+        write = self.write
+        for (prefix, position, encoder), value in zip(segments, values):
+            write_raw(prefix, position)
+            if encoder is not None:
+                value = getattr(self, encoder)(value)
+            write(value)
+        write_raw(tail)
+
+    def render_columns(self, template, *columns, **kwargs):
+        """
+        Write a component from a ComponentTemplate for each row of
+        columns, which are sequences holding the values of each slot.
+
+        Each column is encoded in one pass with its slot's encoder.
+        Columns for "as_timestamp" slots may be NumPy arrays of int64
+        POSIX timestamps or datetime64 values, which are formatted with
+        vectorised NumPy operations. Components are assembled without
+        method calls unless a value needs folding, and written
+        batch_size components at a time.
+
+        Returns the number of components written.
+        """
+        batch_size = kwargs.pop("batch_size", DEFAULT_BATCH_SIZE)
+        if kwargs:
+            raise TypeError("Unexpected keyword arguments: {}".format(
+                ", ".join(sorted(kwargs))))
+
+        segments, tail = template.compile(self.line_length)
+        if len(columns) != len(segments):
+            raise ValueError("{!r} has {} slots, got {} columns".format(
+                template, len(segments), len(columns)))
+
+        assert self.line_position == 0
+
+        encoded = [self._encode_column(encoder, column)
+                   for (_, _, encoder), column in zip(segments, columns)]
+        slots = [(prefix, self.line_length - position)
+                 for prefix, position, _ in segments]
+
+        def fold(writer, value, position):
+            writer.line_position = position
+            writer.write(value)
+
+        parts = []
+        append = parts.append
+        rows = 0
+        for row in six.moves.zip(*encoded):
+            for (prefix, space), value in six.moves.zip(slots, row):
+                append(prefix)
+                if len(value) > space:
+                    value = self.capture(
+                        fold, value, self.line_length - space)
+                    self.line_position = 0
+                append(value)
+            append(tail)
+            rows += 1
+            if not rows % batch_size:
+                self.write_raw(b"".join(parts))
+                del parts[:]
+        if parts:
+            self.write_raw(b"".join(parts))
+        return rows
+
+    def _encode_column(self, encoder, column):
+        if encoder is None:
+            return [v.encode("utf-8") if isinstance(v, six.text_type) else v
+                    for v in column]
+        if encoder == "as_timestamp" and hasattr(column, "dtype"):
+            return _encode_timestamp_array(column)
+        return list(map(getattr(self, encoder), column))
+
+
+def _iter_blocks(data, block_size):
+    """
+    Generate blocks of block_size octets (a multiple of 3) from bytes, a
+    file-like object or an iterable of bytes. The last block may be
+    shorter.
+    """
+    if isinstance(data, (six.binary_type, bytearray)):
+        view = memoryview(data)
+        for start in six.moves.range(0, len(data), block_size):
+            yield view[start:start + block_size].tobytes()
+        return
+
+    read = getattr(data, "read", None)
+    if read is not None:
+        data = iter(lambda: read(block_size), b"")
+
+    pending = bytearray()
+    for chunk in data:
+        pending.extend(chunk)
+        if len(pending) >= block_size:
+            end = len(pending) - len(pending) % block_size
+            for start in six.moves.range(0, end, block_size):
+                yield bytes(pending[start:start + block_size])
+            del pending[:end]
+    if pending:
+        yield bytes(pending)
+
 
 class CalendarWriter(TypesCalendarWriterHelperMixin,
                      CalendarWriterHelperMixin,
                      BaseCalendarWriter):
     pass
+
+
+def _encode_timestamp_array(timestamps):
+    """
+    Encode a NumPy array of POSIX timestamps or datetime64 values as a
+    list of iCalendar DATETIMEs in UTC.
+    """
+    import numpy
+
+    timestamps = numpy.asarray(timestamps)
+    if timestamps.dtype.kind == "M":
+        seconds = timestamps.astype("datetime64[s]").astype(numpy.int64)
+    else:
+        seconds = timestamps.astype(numpy.int64)
+
+    days, seconds = numpy.divmod(seconds, _SECONDS_PER_DAY)
+    minutes, second = numpy.divmod(seconds, 60)
+    hour, minute = numpy.divmod(minutes, 60)
+
+    # Convert days since the epoch to a proleptic Gregorian date, see
+    # http://howardhinnant.github.io/date_algorithms.html#civil_from_days
+    days = days + 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 -
+                   day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 -
+                                year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = numpy.where(month_index < 10, month_index + 3, month_index - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+
+    encoded = numpy.empty((len(timestamps), 16), dtype=numpy.uint8)
+    columns = [(year, 1000), (year, 100), (year, 10), (year, 1),
+               (month, 10), (month, 1), (day, 10), (day, 1), None,
+               (hour, 10), (hour, 1), (minute, 10), (minute, 1),
+               (second, 10), (second, 1)]
+    for i, column in enumerate(columns):
+        if column is not None:
+            value, unit = column
+            encoded[:, i] = value // unit % 10 + ord("0")
+    encoded[:, 8] = ord("T")
+    encoded[:, 15] = ord("Z")
+
+    octets = encoded.tobytes()
+    return [octets[i:i + 16] for i in six.moves.range(0, len(octets), 16)]
+
+
+_vtimezone_cache = LRUCache(DEFAULT_VTIMEZONE_CACHE_SIZE)
+
+
+def _encode_utc_offset(offset):
+    seconds = int(offset.total_seconds())
+    sign = b"-" if seconds < 0 else b"+"
+    minutes, second = divmod(abs(seconds), 60)
+    hour, minute = divmod(minutes, 60)
+    encoded = sign + _DIGITS[hour] + _DIGITS[minute]
+    if second:
+        encoded += _DIGITS[second]
+    return encoded
+
+
+def _posix_tz_rules(zone):
+    """
+    Get the (start, end) daylight saving time rules of the POSIX TZ
+    string in the footer of a timezone's TZif file, or None if it has
+    none.
+    """
+    f = pytz.open_resource(zone)
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    # Version 1 files have no footer
+    if data[:4] != b"TZif" or data[4:5] == b"\0":
+        return None
+    footer = data[data.rindex(b"\n", 0, len(data) - 1) + 1:-1]
+    parts = footer.decode("ascii").split(",")
+    if len(parts) != 3:
+        return None
+    return parts[1], parts[2]
+
+
+def _posix_tz_recur(rule, onset):
+    """
+    Get the as_recur() parts repeating a transition at onset (a naive
+    local time) by a POSIX TZ string rule (Mm.w.d[/time]), or None if the
+    rule can't be written as an RRULE or doesn't give onset.
+    """
+    match = _POSIX_TZ_RULE_RE.match(rule)
+    if match is None:
+        return None
+    month, week, weekday = (int(part) for part in match.group(1, 2, 3))
+    sign, hours, minutes, seconds = match.group(4, 5, 6, 7)
+    time = datetime.timedelta(hours=int(hours or 2), minutes=int(minutes or 0),
+                              seconds=int(seconds or 0))
+    if sign == "-":
+        time = -time
+    # Times outside 00:00 to 24:00 move the transition to another day,
+    # and POSIX weekdays start on Sunday.
+    days, time = time.days, time - datetime.timedelta(days=time.days)
+    weekday = (weekday - 1 + days) % 7
+    # The transition is on the first weekday on or after this day
+    first = days + (week * 7 - 6 if week < 5 else
+                    calendar.monthrange(onset.year, month)[1] - 6)
+    if (onset.month != month or onset.weekday() != weekday or
+            not first <= onset.day < first + 7 or
+            onset - onset.replace(hour=0, minute=0, second=0) != time):
+        return None
+
+    if not days:
+        return {"bymonth": month, "byday": "{}{}".format(
+            -1 if week == 5 else week, _WEEKDAYS[weekday])}
+    # The days must be in the same month every year
+    if (week == 5 and month == 2 or first < 1 or
+            first + 6 > calendar.monthrange(2001, month)[1]):
+        return None
+    return {"bymonth": month, "byday": _WEEKDAYS[weekday],
+            "bymonthday": list(six.moves.range(first, first + 7))}
+
+
+def _observances(tz, first_year, last_year):
+    """
+    Get the (start, offset_from, offset_to, is_dst, name, rule)
+    observances of a pytz timezone in effect from first_year to last_year
+    inclusive, where start is the naive local time (in offset_from) of
+    the onset and rule is None or the as_recur() parts of the RRULE
+    repeating the observance yearly.
+    """
+    times = getattr(tz, "_utc_transition_times", None)
+    if times is None:
+        # A fixed offset timezone
+        dt = datetime.datetime(first_year, 1, 1)
+        offset = tz.utcoffset(dt)
+        return [(_FIRST_OBSERVANCE_START, offset, offset, False,
+                 tz.tzname(dt), None)]
+
+    info = tz._transition_info
+    # Start a day early, as local times early on 1st January can precede
+    # it in UTC.
+    start = bisect.bisect_right(
+        times, datetime.datetime(first_year, 1, 1) -
+        datetime.timedelta(days=1)) - 1
+    stop = bisect.bisect_left(times, datetime.datetime(last_year + 1, 1, 1))
+
+    # The last two transitions (into and out of daylight saving time) of
+    # a table which stops at _LAST_TRANSITION_YEAR are repeated yearly.
+    repeated = len(times)
+    if (last_year > times[-1].year >= _LAST_TRANSITION_YEAR and
+            len(times) > 2):
+        rules = _posix_tz_rules(tz.zone)
+        if rules is None:
+            raise ValueError("{} has no rules for transitions after {}"
+                             .format(tz.zone, times[-1].year))
+        repeated = len(times) - 2
+        start = min(start, repeated)
+
+    observances = []
+    for i in six.moves.range(max(start, 0), stop):
+        offset, dst, name = info[i]
+        if i == 0:
+            onset, offset_from = _FIRST_OBSERVANCE_START, offset
+        else:
+            offset_from = info[i - 1][0]
+            onset = times[i] + offset_from
+        rule = None
+        if i >= repeated:
+            # The start rule is the transition into daylight saving time
+            posix_rule = rules[0 if dst else 1]
+            rule = _posix_tz_recur(posix_rule, onset)
+            if rule is None:
+                raise ValueError(
+                    "Transitions of {} after {} can't be encoded: {}".format(
+                        tz.zone, times[-1].year, posix_rule))
+        observances.append(
+            (onset, offset_from, offset, bool(dst), name, rule))
+    return observances
+
+
+def encode_vtimezone(zone, first_year, last_year,
+                     line_length=DEFAULT_ICAL_LINE_LENGTH):
+    """
+    Encode a VTIMEZONE component for zone (a pytz timezone or its name)
+    with an observance for each transition from first_year to last_year
+    inclusive, generated from the pytz transition tables. Transitions
+    after the tables stop (in 2037) are written as yearly RRULEs from the
+    timezone's POSIX TZ string, and ValueError is raised if they can't
+    be.
+
+    Encoded components are cached, so generating the same component for
+    each of many calendars is cheap.
+    """
+    if not isinstance(zone, six.string_types):
+        zone = zone.zone
+    key = (zone, first_year, last_year, line_length)
+    encoded = _vtimezone_cache.get(key)
+    if encoded is not None:
+        return encoded
+
+    observances = _observances(pytz.timezone(zone), first_year, last_year)
+
+    out = six.BytesIO()
+    writer = CalendarWriter(out, line_length)
+    writer.begin("VTIMEZONE")
+    writer.contentline("TZID", writer.as_text(zone))
+    for onset, offset_from, offset_to, is_dst, name, rule in observances:
+        section = "DAYLIGHT" if is_dst else "STANDARD"
+        writer.begin(section)
+        writer.contentline("DTSTART", writer.as_local_datetime(
+            pytz.utc.localize(onset)))
+        writer.contentline("TZOFFSETFROM", _encode_utc_offset(offset_from))
+        writer.contentline("TZOFFSETTO", _encode_utc_offset(offset_to))
+        writer.contentline("TZNAME", writer.as_text(name))
+        if rule is not None:
+            writer.contentline("RRULE", writer.as_recur("YEARLY", **rule))
+        writer.end(section)
+    writer.end("VTIMEZONE")
+
+    encoded = out.getvalue()
+    _vtimezone_cache[key] = encoded
+    return encoded
+
+
+class CompressedOutput(object):
+    """
+    A file-like output which compresses the octets written to it, writing
+    the compressed octets to another output.
+
+    format is "gzip", "deflate" (zlib format, as used by HTTP's deflate
+    content coding) or "raw" (deflate with no header). flush_mode is the
+    zlib flush mode used after each write: the default, zlib.Z_NO_FLUSH,
+    gives the best compression; zlib.Z_SYNC_FLUSH makes everything
+    written so far decompressible by the receiver straight away.
+
+    Compressing many small writes is slow, so CalendarWriters writing to
+    a CompressedOutput should be buffered::
+
+        writer = CalendarWriter(CompressedOutput(f), buffer_size=64 * 1024)
+
+    close() must be called to write the end of the compressed stream.
+    """
+
+    def __init__(self, output, format="gzip", level=DEFAULT_COMPRESS_LEVEL,
+                 flush_mode=zlib.Z_NO_FLUSH):
+        try:
+            wbits = _COMPRESSION_WBITS[format]
+        except KeyError:
+            raise ValueError("Unknown compression format: {!r}"
+                             .format(format))
+
+        self.output = output
+        self.flush_mode = flush_mode
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def write(self, octets):
+        compressor = self._compressor
+        data = compressor.compress(octets)
+        if self.flush_mode != zlib.Z_NO_FLUSH:
+            data += compressor.flush(self.flush_mode)
+        if data:
+            self.output.write(data)
+
+    def flush(self):
+        """
+        Write everything written so far to the output such that it can be
+        decompressed, and flush the output if it supports flushing.
+        """
+        self.output.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        flush = getattr(self.output, "flush", None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        """
+        Finish the compressed stream and close the output.
+        """
+        self.output.write(self._compressor.flush(zlib.Z_FINISH))
+        close = getattr(self.output, "close", None)
+        if close is not None:
+            close()
+
+
+class FileDescriptorOutput(object):
+    """
+    A file-like output writing to a file descriptor, such as a file
+    opened with os.open() or a blocking socket's fileno().
+
+    Written octets aren't copied or joined: they're queued and written in
+    batches of up to max_iovecs buffers with a single os.writev() call
+    once batch_size octets are queued, or when flushed. Octets written
+    must not be modified afterwards.
+
+    This suits unbuffered writers writing mostly large, pre-rendered
+    octets, e.g. with render_cached() and write_file(). Writers writing
+    many small values are faster with a buffer_size and a regular file.
+
+    close() flushes the output and, if closefd is true, closes fd.
+    """
+
+    def __init__(self, fd, batch_size=DEFAULT_CHUNK_SIZE,
+                 max_iovecs=DEFAULT_MAX_IOVECS, closefd=True):
+        self.fd = fd
+        self.batch_size = batch_size
+        self.max_iovecs = max_iovecs
+        self.closefd = closefd
+        self._iovecs = []
+        self._queued = 0
+        try:
+            self._position = os.lseek(fd, 0, os.SEEK_CUR)
+        except OSError:
+            # Not seekable, e.g. a socket or pipe
+            self._position = 0
+
+    def write(self, octets):
+        iovecs = self._iovecs
+        iovecs.append(octets)
+        self._queued += len(octets)
+        if self._queued >= self.batch_size or len(iovecs) >= self.max_iovecs:
+            self.flush()
+
+    def tell(self):
+        return self._position + self._queued
+
+    def flush(self):
+        """
+        Write all queued octets to fd.
+        """
+        iovecs = self._iovecs
+        while iovecs:
+            batch = iovecs[:self.max_iovecs]
+            written = _writev(self.fd, batch)
+
+            # Remove what was written, which may end part way through a
+            # buffer.
+            done = 0
+            for octets in batch:
+                if written < len(octets):
+                    break
+                written -= len(octets)
+                done += 1
+            del iovecs[:done]
+            if written:
+                iovecs[0] = iovecs[0][written:]
+        self._position += self._queued
+        self._queued = 0
+
+    def sendfile(self, f, offset=0, count=None):
+        """
+        Write count octets (by default, all) of the file f from offset
+        using os.sendfile() where possible, so the octets are copied by
+        the kernel.
+        """
+        self.flush()
+        if count is None:
+            count = os.fstat(f.fileno()).st_size - offset
+        self._position += count
+
+        sendfile = getattr(os, "sendfile", None)
+        while count > 0:
+            if sendfile is not None:
+                try:
+                    sent = sendfile(self.fd, f.fileno(), offset, count)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise
+                    # Not supported for this kind of fd
+                    sendfile = None
+                    continue
+            else:
+                f.seek(offset)
+                octets = f.read(min(count, DEFAULT_READ_SIZE))
+                sent = _writev(self.fd, [octets]) if octets else 0
+            if not sent:
+                raise IOError("Unexpected end of file: {!r}".format(f))
+            offset += sent
+            count -= sent
+
+    def close(self):
+        self.flush()
+        if self.closefd:
+            os.close(self.fd)
+
+
+try:
+    _writev = os.writev
+except AttributeError:
+    # Not available on Windows or Python 2
+    def _writev(fd, buffers):
+        return os.write(fd, b"".join(buffers))
+
+
+class _ChunkQueue(collections.deque):
+    """
+    A file-like output which queues the octets written to it.
+    """
+    write = collections.deque.append
+
+
+def iter_chunks(render, chunk_size=DEFAULT_CHUNK_SIZE, compression=None,
+                compress_level=DEFAULT_COMPRESS_LEVEL, writer_class=None,
+                **kwargs):
+    """
+    Generate the output of render(writer) as chunks of around chunk_size
+    octets, e.g. to form the body of a WSGI response::
+
+        def render(writer):
+            writer.begin("VCALENDAR")
+            for event in events:
+                write_event(writer, event)
+                yield
+            writer.end("VCALENDAR")
+
+        return iter_chunks(render)
+
+    render is called with a buffered CalendarWriter (or writer_class),
+    created with any extra keyword arguments. If render returns an
+    iterator (i.e. it's a generator function) chunks are generated as they
+    fill each time it yields, so only around one chunk of output is held
+    in memory at once.
+
+    If compression is given, the output is compressed in that format
+    (see CompressedOutput). Compressed chunks are generated as the
+    compressor produces them, so their sizes vary.
+    """
+    chunks = _ChunkQueue()
+    if compression is None:
+        output = chunks
+    else:
+        output = CompressedOutput(chunks, compression, compress_level)
+    writer = (writer_class or CalendarWriter)(
+        output, buffer_size=chunk_size, **kwargs)
+    popleft = chunks.popleft
+
+    steps = render(writer)
+    if steps is not None:
+        for _ in steps:
+            while chunks:
+                yield popleft()
+
+    writer.close()
+    while chunks:
+        yield popleft()
+
+
+def _render_batch(render, items, writer_kwargs):
+    out = six.BytesIO()
+    writer = CalendarWriter(out, **writer_kwargs)
+    for item in items:
+        render(writer, item)
+    writer.flush()
+    return out.getvalue()
+
+
+def render_parallel(items, render, header=None, batch_size=DEFAULT_BATCH_SIZE,
+                    executor=None, max_workers=None, max_pending=None,
+                    **kwargs):
+    """
+    Render a VCALENDAR in parallel, generating its octets in order.
+
+    render(writer, item) is called in a worker process for each item to
+    write a component to a CalendarWriter, created with any extra keyword
+    arguments. Items are sent to the workers in batches of batch_size and
+    each batch's output is generated as one chunk, in the order of items.
+    header(writer), if given, writes the calendar's properties (VERSION,
+    PRODID, etc.) after BEGIN:VCALENDAR.
+
+    Components are independent blocks of complete content lines, so the
+    output is identical to rendering the items one after another. render,
+    the items and the keyword arguments must be picklable.
+
+    By default a ProcessPoolExecutor with max_workers processes is used;
+    an existing concurrent.futures executor can be passed instead. At most
+    max_pending batches (by default twice the number of CPUs) are rendered
+    ahead of the consumer.
+    """
+    from concurrent import futures
+
+    if max_pending is None:
+        max_pending = 2 * (max_workers or multiprocessing.cpu_count())
+
+    out = six.BytesIO()
+    writer = CalendarWriter(out, **kwargs)
+    writer.begin("VCALENDAR")
+    if header is not None:
+        header(writer)
+    writer.flush()
+    yield out.getvalue()
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = futures.ProcessPoolExecutor(max_workers)
+
+    pending = collections.deque()
+    items = iter(items)
+    try:
+        while True:
+            while len(pending) < max_pending:
+                batch = list(itertools.islice(items, batch_size))
+                if not batch:
+                    break
+                pending.append(executor.submit(
+                    _render_batch, render, batch, kwargs))
+            if not pending:
+                break
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        if owns_executor:
+            executor.shutdown()
+
+    out = six.BytesIO()
+    writer = CalendarWriter(out, **kwargs)
+    writer.end("VCALENDAR")
+    writer.flush()
+    yield out.getvalue()
+
+
+class _Completed(object):
+    """
+    An awaitable which completes immediately with a value.
+    """
+
+    def __init__(self, value=None):
+        self.value = value
+
+    def __await__(self):
+        return self
+
+    __iter__ = __await__
+
+    def __next__(self):
+        raise StopIteration(self.value)
+
+    next = __next__
+
+
+class AsyncCalendarWriter(CalendarWriter):
+    """
+    A CalendarWriter which sends its output to an asyncio StreamWriter or
+    to an ASGI send callable.
+
+    Output is buffered and split into chunks of around chunk_size octets.
+    Chunks are sent by drain(), which returns an awaitable that waits for
+    the output to accept more data, so callers should await it
+    periodically (e.g. after each component) to keep memory use bounded::
+
+        writer = AsyncCalendarWriter(send)
+        writer.begin("VCALENDAR")
+        for event in events:
+            write_event(writer, event)
+            await writer.drain()
+        writer.end("VCALENDAR")
+        await writer.close()
+
+    When writing to an ASGI send callable, the caller is responsible for
+    sending the http.response.start message. close() sends the final
+    http.response.body message. StreamWriters are drained but not closed.
+    """
+
+    def __init__(self, output, line_length=DEFAULT_ICAL_LINE_LENGTH,
+                 chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        if hasattr(output, "drain"):
+            self._send = self._send_stream
+        elif callable(output):
+            self._send = self._send_asgi
+        else:
+            raise TypeError(
+                "output must be an asyncio StreamWriter or an ASGI send "
+                "callable, got: {!r}".format(output))
+
+        super(AsyncCalendarWriter, self).__init__(
+            output, line_length, buffer_size=chunk_size, **kwargs)
+        self._chunks = []
+
+    def flush(self):
+        """
+        Move buffered octets to the chunks waiting to be sent by drain().
+        """
+        buffer = self._buffer
+        if buffer:
+            self._chunks.append(bytes(buffer))
+            del buffer[:]
+
+    def drain(self):
+        """
+        Send any complete chunks to the output.
+
+        Returns an awaitable which completes when the output is ready to
+        receive more data.
+        """
+        chunks = self._chunks
+        if not chunks:
+            return _Completed()
+        data = b"".join(chunks)
+        del chunks[:]
+        return self._send(data, True)
+
+    def close(self):
+        """
+        Send all remaining output.
+
+        Returns an awaitable which completes when it has been sent.
+        """
+        self.flush()
+        data = b"".join(self._chunks)
+        del self._chunks[:]
+        return self._send(data, False)
+
+    def _send_stream(self, data, more):
+        if data:
+            self.output.write(data)
+        return self.output.drain()
+
+    def _send_asgi(self, data, more):
+        return self.output({
+            "type": "http.response.body",
+            "body": data,
+            "more_body": more
+        })
+
+    def __enter__(self):
+        raise TypeError("Use async with to manage an AsyncCalendarWriter")
+
+    def __aenter__(self):
+        return _Completed(self)
+
+    def __aexit__(self, exc_type, exc_value, traceback):
+        return self.close()
+
+
+class InstrumentedCalendarWriterMixin(object):
+    """
+    Counts what a CalendarWriter does, and optionally times it.
+
+    Instrumentation is provided by overriding methods rather than by
+    checks in CalendarWriter itself, so uninstrumented writers don't pay
+    for it. The counters are:
+
+    * octets, output_writes: octets and write() calls sent to the output
+      (for buffered writers, when the buffer is flushed)
+    * contentlines, folds: content lines ended and lines folded
+    * as_text, as_datetime, datetime_cache_hits: encoder calls and cache
+      hits of as_datetime()
+
+    If timing is true, the time spent in as_text(), as_datetime(), write()
+    and flush() is totalled per phase. If timing_callback is given it's
+    called with the phase name and duration of each timed call. Phases can
+    nest (e.g. flush() can happen within write()).
+    """
+
+    counter_names = ("octets", "output_writes", "contentlines", "folds",
+                     "as_text", "as_datetime", "datetime_cache_hits")
+
+    timed_phases = ("as_text", "as_datetime", "write", "flush")
+
+    def __init__(self, *args, **kwargs):
+        timing = kwargs.pop("timing", False)
+        timing_callback = kwargs.pop("timing_callback", None)
+        super(InstrumentedCalendarWriterMixin, self).__init__(*args, **kwargs)
+
+        self.counters = counters = dict.fromkeys(self.counter_names, 0)
+        self.timings = {}
+        self.timing_callback = timing_callback
+
+        if self._buffer is None:
+            write = self._write
+
+            def counting_write(octets):
+                counters["output_writes"] += 1
+                counters["octets"] += len(octets)
+                write(octets)
+            self._write = counting_write
+
+        if timing or timing_callback is not None:
+            self.timings = dict.fromkeys(self.timed_phases, 0.0)
+            for phase in self.timed_phases:
+                setattr(self, phase, self._timed(phase, getattr(self, phase)))
+
+    def _timed(self, phase, method):
+        timings = self.timings
+        clock = _clock
+
+        def timed(*args):
+            start = clock()
+            try:
+                return method(*args)
+            finally:
+                duration = clock() - start
+                timings[phase] += duration
+                if self.timing_callback is not None:
+                    self.timing_callback(phase, duration)
+        return timed
+
+    def flush(self):
+        buffer = self._buffer
+        if buffer:
+            self.counters["output_writes"] += 1
+            self.counters["octets"] += len(buffer)
+        super(InstrumentedCalendarWriterMixin, self).flush()
+
+    def endline(self, is_wrapping):
+        if is_wrapping:
+            self.counters["folds"] += 1
+        else:
+            self.counters["contentlines"] += 1
+        super(InstrumentedCalendarWriterMixin, self).endline(is_wrapping)
+
+    def render(self, template, *values):
+        # The template's static content lines are written without endline()
+        self.counters["contentlines"] += len(template.lines) + 2
+        super(InstrumentedCalendarWriterMixin, self).render(template, *values)
+
+    def render_columns(self, template, *columns, **kwargs):
+        rows = super(InstrumentedCalendarWriterMixin, self).render_columns(
+            template, *columns, **kwargs)
+        self.counters["contentlines"] += (len(template.lines) + 2) * rows
+        return rows
+
+    def as_text(self, text):
+        self.counters["as_text"] += 1
+        return super(InstrumentedCalendarWriterMixin, self).as_text(text)
+
+    def as_datetime(self, dt):
+        counters = self.counters
+        counters["as_datetime"] += 1
+        if dt in self._datetime_cache:
+            counters["datetime_cache_hits"] += 1
+        return super(InstrumentedCalendarWriterMixin, self).as_datetime(dt)
+
+    def stats(self):
+        """
+        Get the counters, cache statistics and timings as a flat dict.
+        Timings are in seconds and named time_<phase>.
+        """
+        stats = dict(self.counters)
+        stats["param_cache_hits"] = self.param_cache.hits
+        stats["param_cache_misses"] = self.param_cache.misses
+        if self.text_cache is not None:
+            stats["text_cache_hits"] = self.text_cache.hits
+            stats["text_cache_misses"] = self.text_cache.misses
+        for phase, seconds in self.timings.items():
+            stats["time_" + phase] = seconds
+        return stats
+
+
+class InstrumentedCalendarWriter(InstrumentedCalendarWriterMixin,
+                                 CalendarWriter):
+    pass
+
+
+class ValidationError(ValueError):
+    """
+    Raised by ValidatingCalendarWriter when its methods are called in a
+    sequence which would produce invalid iCalendar content.
+    """
+
+
+def _name_key(name):
+    if isinstance(name, six.binary_type):
+        name = name.decode("utf-8")
+    return name.upper()
+
+
+_IDLE, _STARTED, _HAS_VALUE = range(3)
+
+_NOTHING_MISSING = frozenset()
+
+_NO_CHILDREN = {}
+
+
+class ValidatingCalendarWriterMixin(object):
+    """
+    Checks that a CalendarWriter's methods are called in a sequence which
+    produces valid iCalendar structure. A ValidationError is raised when:
+
+    * a component is begun inside a component which can't contain it
+      (according to the transitions table)
+    * end() doesn't match the most recent unended begin()
+    * a component is ended without its required properties
+    * content lines are written outside of any component
+    * a content line is ended without a value, or a content line is
+      started while another is unfinished
+    * the writer is closed with components still open
+
+    Components must be started and ended with begin() and end() (or
+    written by render()) for their nesting to be tracked. Content lines
+    only have their names recorded; required properties are checked when
+    their component is ended, so most of the cost is in begin() and end().
+    """
+
+    # The components each component (or None, the top level) may contain.
+    # Experimental (X-) components may appear in any component.
+    transitions = {
+        None: frozenset(["VCALENDAR"]),
+        "VCALENDAR": frozenset([
+            "VEVENT", "VTODO", "VJOURNAL", "VFREEBUSY", "VTIMEZONE",
+            "VAVAILABILITY"]),
+        "VEVENT": frozenset(["VALARM"]),
+        "VTODO": frozenset(["VALARM"]),
+        "VTIMEZONE": frozenset(["STANDARD", "DAYLIGHT"]),
+        "VAVAILABILITY": frozenset(["AVAILABLE"]),
+    }
+
+    # Properties which must be present before a component can be ended
+    required_properties = {
+        "VCALENDAR": frozenset(["PRODID", "VERSION"]),
+        "VEVENT": frozenset(["UID", "DTSTAMP"]),
+        "VTODO": frozenset(["UID", "DTSTAMP"]),
+        "VJOURNAL": frozenset(["UID", "DTSTAMP"]),
+        "VFREEBUSY": frozenset(["UID", "DTSTAMP"]),
+        "VTIMEZONE": frozenset(["TZID"]),
+        "STANDARD": frozenset(["DTSTART", "TZOFFSETFROM", "TZOFFSETTO"]),
+        "DAYLIGHT": frozenset(["DTSTART", "TZOFFSETFROM", "TZOFFSETTO"]),
+        "VALARM": frozenset(["ACTION", "TRIGGER"]),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(ValidatingCalendarWriterMixin, self).__init__(*args, **kwargs)
+
+        # The transition table: for each component (or None, the top
+        # level), the components it may contain mapped to their own table
+        # entry and required properties, so begin() needs one lookup.
+        self._table = dict(
+            (parent, {}) for parent in self.transitions)
+        for parent, children in self.transitions.items():
+            for child in children:
+                self._table[parent][child] = (
+                    self._table.get(child, _NO_CHILDREN),
+                    self.required_properties.get(child, _NOTHING_MISSING))
+
+        self._components = []
+        # The table entry of the current component
+        self._children = self._table.get(None, _NO_CHILDREN)
+        # The required properties of the current component and the names of
+        # the properties written in it, which are only compared in end().
+        self._required = _NOTHING_MISSING
+        self._names = set()
+        # The _children, _required and _names of the enclosing components
+        self._stack = []
+        self._state = _IDLE
+        # Called with the name of each content line: adds it to _names
+        # inside a component, or raises a ValidationError when a content
+        # line can't be written.
+        self._wrote = self._outside_component
+        self._name_keys = {}
+
+        # Content lines are validated for every property, so the next
+        # implementations are looked up once rather than via super() calls.
+        next_impl = super(ValidatingCalendarWriterMixin, self)
+        self._next_start_contentline = next_impl.start_contentline
+        self._next_value = next_impl.value
+        self._next_end_contentline = next_impl.end_contentline
+
+    def _key(self, name):
+        keys = self._name_keys
+        key = keys.get(name)
+        if key is None:
+            if len(keys) >= 1024:
+                keys.clear()
+            key = keys[name] = _name_key(name)
+        return key
+
+    def _check_begin_component(self, key):
+        """
+        Get the table entry and required properties of a component which
+        isn't in the transition table, or raise a ValidationError.
+        """
+        if self._state is not _IDLE:
+            raise ValidationError(
+                "{} begun before the content line was ended".format(key))
+        entry = self._children.get(key)
+        if entry is not None:
+            return entry
+
+        components = self._components
+        if not components or not key.startswith("X-"):
+            raise ValidationError("{} can't be begun {}".format(
+                key, "in " + components[-1] if components
+                else "at the top level"))
+        return (self._table.get(key, _NO_CHILDREN),
+                self.required_properties.get(key, _NOTHING_MISSING))
+
+    def _missing_properties(self):
+        required, names = self._required, self._names
+        missing = required.difference(names)
+        if missing:
+            # Property names needn't have been written in upper case
+            missing = required.difference(map(self._key, names))
+        return missing
+
+    def _check_end_component(self, key):
+        components = self._components
+        if not components:
+            raise ValidationError(
+                "end({!r}) has no matching begin()".format(key))
+        if components[-1] != key:
+            raise ValidationError("end({!r}) doesn't match begin({!r})"
+                                  .format(key, components[-1]))
+        missing = self._missing_properties()
+        if missing:
+            raise ValidationError("{} is missing required properties: {}"
+                                  .format(key, ", ".join(sorted(missing))))
+        if self._state is not _IDLE:
+            raise ValidationError(
+                "{} ended before the content line was ended".format(key))
+
+    def _push_component(self, key, entry, names):
+        self._stack.append((self._children, self._required, self._names))
+        self._components.append(key)
+        self._children, self._required = entry
+        self._names = names
+        self._wrote = names.add
+
+    def _pop_component(self):
+        components = self._components
+        components.pop()
+        self._children, self._required, names = self._stack.pop()
+        self._names = names
+        self._wrote = names.add if components else self._outside_component
+
+    def begin(self, section):
+        key = self._name_keys.get(section) or self._key(section)
+        entry = self._children.get(key)
+        if entry is None or self._state is not _IDLE:
+            entry = self._check_begin_component(key)
+
+        # Inlined _push_component()
+        self._stack.append((self._children, self._required, self._names))
+        self._components.append(key)
+        self._children, self._required = entry
+        names = self._names = set()
+        self._wrote = names.add
+
+        self._next_start_contentline("BEGIN")
+        self._next_value(section)
+        self._next_end_contentline()
+
+    def end(self, section):
+        key = self._name_keys.get(section) or self._key(section)
+        components = self._components
+        if (not components or components[-1] != key or
+                self._state is not _IDLE or
+                not self._required <= self._names):
+            self._check_end_component(key)
+
+        self._next_start_contentline("END")
+        self._next_value(section)
+        self._next_end_contentline()
+
+        # Inlined _pop_component()
+        components.pop()
+        self._children, self._required, names = self._stack.pop()
+        self._names = names
+        self._wrote = names.add if components else self._outside_component
+
+    def render(self, template, *values):
+        key = self._key(template.section)
+        entry = self._check_begin_component(key)
+        self._push_component(key, entry, set(template.property_names))
+        try:
+            self._check_end_component(key)
+            super(ValidatingCalendarWriterMixin, self).render(
+                template, *values)
+        finally:
+            self._pop_component()
+
+    def render_columns(self, template, *columns, **kwargs):
+        key = self._key(template.section)
+        entry = self._check_begin_component(key)
+        self._push_component(key, entry, set(template.property_names))
+        try:
+            self._check_end_component(key)
+            return super(ValidatingCalendarWriterMixin, self).render_columns(
+                template, *columns, **kwargs)
+        finally:
+            self._pop_component()
+
+    def _outside_component(self, name):
+        raise ValidationError(
+            "Content line {!r} is outside of any component".format(name))
+
+    def _unfinished_contentline(self, name):
+        raise ValidationError(
+            "Content line {!r} started before the previous content line "
+            "was ended".format(name))
+
+    def contentline(self, name, value, params=None):
+        self._wrote(name)
+        if params is None:
+            self._next_start_contentline(name)
+        else:
+            self._next_start_contentline(name, params)
+        self._next_value(value)
+        self._next_end_contentline()
+
+    def start_contentline(self, name, params=None):
+        self._wrote(name)
+        self._state = _STARTED
+        self._wrote = self._unfinished_contentline
+        if params is None:
+            self._next_start_contentline(name)
+        else:
+            self._next_start_contentline(name, params)
+
+    def value(self, value):
+        if self._state is _IDLE:
+            raise ValidationError(
+                "value() called outside of a content line")
+        self._state = _HAS_VALUE
+        self._next_value(value)
+
+    def end_contentline(self):
+        if self._state is not _HAS_VALUE:
+            raise ValidationError(
+                "end_contentline() called without a value" if self._state
+                else "end_contentline() called without start_contentline()")
+        self._state = _IDLE
+        # Content lines are only started inside a component
+        self._wrote = self._names.add
+        self._next_end_contentline()
+
+    def write_raw(self, octets, line_position=0):
+        if self._state is not _IDLE:
+            raise ValidationError(
+                "write_raw() called before the content line was ended")
+        if not self._components:
+            raise ValidationError(
+                "write_raw() called outside of any component")
+        super(ValidatingCalendarWriterMixin, self).write_raw(
+            octets, line_position)
+
+    def close(self):
+        if self._components:
+            raise ValidationError("Components not ended: {}".format(
+                ", ".join(self._components)))
+        super(ValidatingCalendarWriterMixin, self).close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't hide the original error with a ValidationError
+            super(ValidatingCalendarWriterMixin, self).close()
+
+
+class ValidatingCalendarWriter(ValidatingCalendarWriterMixin, CalendarWriter):
+    pass
+
+
+class ComponentTemplate(object):
+    """
+    A component with a fixed sequence of properties, some of which have
+    values that vary between instances of the component (slots).
+
+    The static parts of the component (property names, separators and
+    constant content lines) are encoded and folded once, so rendering a
+    template with CalendarWriter.render() only has to encode and fold the
+    slot values.
+
+    For example::
+
+        event = ComponentTemplate("VEVENT")
+        event.slot("UID")
+        event.slot("DTSTART", "as_datetime")
+        event.contentline("ORGANIZER", "MAILTO:john.doe@example.com",
+                          params={"CN": "John Doe"})
+        event.slot("SUMMARY", "as_text")
+
+        writer.render(event, uid, start, summary)
+    """
+
+    def __init__(self, section):
+        self.section = section
+        self.lines = []
+        self.property_names = set()
+        self._compiled = {}
+
+    def contentline(self, name, value, params=None):
+        """
+        Add a content line with a constant value.
+        """
+        self.lines.append((name, params, value, None, False))
+        self.property_names.add(_name_key(name))
+        self._compiled.clear()
+
+    def slot(self, name, encoder=None, params=None):
+        """
+        Add a content line whose value is supplied when rendering.
+
+        encoder is the name of a CalendarWriter method (e.g. "as_text")
+        used to encode the value. If it's None the value is written as is.
+        """
+        self.lines.append((name, params, None, encoder, True))
+        self.property_names.add(_name_key(name))
+        self._compiled.clear()
+
+    def compile(self, line_length=DEFAULT_ICAL_LINE_LENGTH):
+        """
+        Get the encoded form of the template for the given line length.
+
+        Returns a (segments, tail) pair. segments contains a
+        (prefix, line_position, encoder) tuple for each slot, where prefix
+        is the folded octets preceding the slot value and line_position
+        is the position on the line after prefix has been written. tail
+        is the folded octets following the last slot.
+        """
+        try:
+            return self._compiled[line_length]
+        except KeyError:
+            pass
+
+        out = six.BytesIO()
+        writer = CalendarWriter(out, line_length=line_length)
+        segments = []
+
+        writer.begin(self.section)
+        for name, params, value, encoder, is_slot in self.lines:
+            if is_slot:
+                writer.start_contentline(name, params)
+                segments.append(
+                    (out.getvalue(), writer.line_position, encoder))
+                out.seek(0)
+                out.truncate()
+                writer.end_contentline()
+            else:
+                writer.contentline(name, value, params)
+        writer.end(self.section)
+
+        compiled = (segments, out.getvalue())
+        self._compiled[line_length] = compiled
+        return compiled
+
+    def __repr__(self):
+        return "<ComponentTemplate {!r}>".format(self.section)
+
+
+class ComponentCache(object):
+    """
+    A cache of rendered components, for use with render_cached().
+
+    Up to maxsize components are held in memory. If path is given they
+    are also stored in an SQLite database file, so that they can be reused
+    by later processes; the database holds at most max_stored components,
+    discarding the least recently used when flushed.
+
+    The octets of a component depend on the writer's line length, so a
+    cache must only be used with writers of a single line length. Caches
+    with a path must be closed (or flushed) to save the components added
+    to them.
+
+    digest() gives the hash (using hash_algorithm) of a cached component,
+    for computing a FeedDigest without rendering anything.
+    """
+
+    def __init__(self, maxsize=DEFAULT_COMPONENT_CACHE_SIZE, path=None,
+                 max_stored=None, hash_algorithm=DEFAULT_HASH_ALGORITHM):
+        self.memory = LRUCache(maxsize)
+        self.hash_algorithm = hash_algorithm
+        self._digests = LRUCache(maxsize)
+        self.path = path
+        self.max_stored = max_stored
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+
+        if path is not None:
+            import sqlite3
+            self._binary = sqlite3.Binary
+            self._db = sqlite3.connect(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS components ("
+                "key TEXT PRIMARY KEY, octets BLOB NOT NULL, "
+                "used INTEGER NOT NULL)")
+            last_used = self._db.execute(
+                "SELECT MAX(used) FROM components").fetchone()[0]
+            self._use_count = itertools.count((last_used or 0) + 1)
+            self._used = {}
+
+    @staticmethod
+    def _encode_key(key):
+        if isinstance(key, tuple):
+            return "\x1f".join(six.text_type(part) for part in key)
+        return six.text_type(key)
+
+    def get(self, key, default=None):
+        key = self._encode_key(key)
+        octets = self.memory.get(key)
+        if self._db is not None:
+            if octets is None:
+                row = self._db.execute(
+                    "SELECT octets FROM components WHERE key = ?",
+                    (key,)).fetchone()
+                if row is not None:
+                    octets = bytes(row[0])
+                    self.memory[key] = octets
+            if octets is not None:
+                # Stored use counts are updated in bulk by flush()
+                self._used[key] = next(self._use_count)
+
+        if octets is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return octets
+
+    def digest(self, key):
+        """
+        Get the digest of the component stored under key, or None if it
+        isn't cached.
+        """
+        digest = self._digests.get(self._encode_key(key))
+        if digest is None:
+            octets = self.get(key)
+            if octets is None:
+                return None
+            digest = hashlib.new(self.hash_algorithm, octets).digest()
+            self._digests[self._encode_key(key)] = digest
+        return digest
+
+    def __setitem__(self, key, octets):
+        key = self._encode_key(key)
+        self.memory[key] = octets
+        self._digests[key] = hashlib.new(self.hash_algorithm, octets).digest()
+        if self._db is not None:
+            self._used.pop(key, None)
+            self._db.execute(
+                "INSERT OR REPLACE INTO components VALUES (?, ?, ?)",
+                (key, self._binary(octets), next(self._use_count)))
+
+    def __len__(self):
+        return len(self.memory)
+
+    def flush(self):
+        """
+        Save the stored components, discarding the least recently used
+        if more than max_stored are stored.
+        """
+        if self._db is None:
+            return
+        self._db.executemany(
+            "UPDATE components SET used = ? WHERE key = ?",
+            [(used, key) for key, used in six.iteritems(self._used)])
+        self._used.clear()
+        if self.max_stored is not None:
+            self._db.execute(
+                "DELETE FROM components WHERE key NOT IN ("
+                "SELECT key FROM components ORDER BY used DESC LIMIT ?)",
+                (self.max_stored,))
+        self._db.commit()
+
+    def close(self):
+        """
+        Flush and close the database, if any.
+        """
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HashingOutput(object):
+    """
+    A file-like output which hashes the octets written to it with
+    hashlib algorithm, passing them on to output (if any). After closing,
+    digest is the hex digest of everything written and length the number
+    of octets written.
+
+    Writers hashing their output should be buffered, as hashing many small
+    writes is slow.
+    """
+
+    def __init__(self, output=None, algorithm=DEFAULT_HASH_ALGORITHM):
+        self.output = output
+        self.hash = hashlib.new(algorithm)
+        self.length = 0
+        self.digest = None
+
+    def write(self, octets):
+        self.hash.update(octets)
+        self.length += len(octets)
+        if self.output is not None:
+            self.output.write(octets)
+
+    def hexdigest(self):
+        """
+        Get the hex digest of the octets written so far.
+        """
+        return self.hash.hexdigest()
+
+    def flush(self):
+        flush = getattr(self.output, "flush", None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        self.digest = self.hash.hexdigest()
+        close = getattr(self.output, "close", None)
+        if close is not None:
+            close()
+
+
+class FeedDigest(object):
+    """
+    Combines the digests of a calendar's components into a digest of the
+    calendar, e.g. for an HTTP ETag.
+
+    A FeedDigest built while rendering a calendar and one built later from
+    a ComponentCache's digest()s are equal if the calendar's components are
+    unchanged, so If-None-Match requests can be answered without rendering.
+    Octets which aren't cached components (e.g. calendar properties) are
+    added with add().
+    """
+
+    def __init__(self, algorithm=DEFAULT_HASH_ALGORITHM):
+        self.algorithm = algorithm
+        self.hash = hashlib.new(algorithm)
+
+    def add(self, octets):
+        """
+        Add a component (or other octets) of the calendar.
+        """
+        self.hash.update(hashlib.new(self.algorithm, octets).digest())
+
+    def add_digest(self, digest):
+        """
+        Add a component by its digest, as given by ComponentCache.digest().
+        """
+        self.hash.update(digest)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+    def etag(self):
+        """
+        Get the digest as a quoted HTTP entity tag.
+        """
+        return '"{}"'.format(self.hexdigest())
+
+
+class FanOut(object):
+    """
+    Writes components to many CalendarWriters (feeds) at once, encoding,
+    escaping and folding each component only once.
+
+    writers maps feed names to writers, which must all have the same line
+    length. For example::
+
+        fan_out = FanOut({"a": writer_a, "b": writer_b, "c": writer_c})
+        fan_out.component(["a", "c"], render_lecture, lecture)
+
+    Components are rendered by a private writer_class instance (by
+    default a CalendarWriter) created with writer_kwargs. To share
+    components between feeds written one after another, use
+    render_cached() with a ComponentCache instead.
+    """
+
+    def __init__(self, writers, line_length=DEFAULT_ICAL_LINE_LENGTH,
+                 writer_class=None, **writer_kwargs):
+        for name, writer in six.iteritems(writers):
+            if writer.line_length != line_length:
+                raise ValueError(
+                    "Writer {!r} has line_length {}, expected {}".format(
+                        name, writer.line_length, line_length))
+        self.writers = writers
+        if writer_class is None:
+            writer_class = CalendarWriter
+        self.renderer = writer_class(six.BytesIO(), line_length,
+                                     **writer_kwargs)
+
+    def write_raw(self, feeds, octets):
+        """
+        Write octets containing complete content lines to each of feeds,
+        or to every feed if feeds is None.
+        """
+        writers = self.writers
+        if feeds is None:
+            for writer in six.itervalues(writers):
+                writer.write_raw(octets)
+        else:
+            for feed in feeds:
+                writers[feed].write_raw(octets)
+
+    def component(self, feeds, render, *args):
+        """
+        Write the component written by render(writer, *args) to each of
+        feeds (or every feed if feeds is None), and return its octets.
+        """
+        octets = self.renderer.capture(render, *args)
+        self.write_raw(feeds, octets)
+        return octets
+
+    def render(self, feeds, template, *values):
+        """
+        Write a ComponentTemplate filled with values to each of feeds (or
+        every feed if feeds is None), and return its octets.
+        """
+        return self.component(feeds, _render_template, template, values)
+
+    def close(self):
+        """
+        Close every feed's writer.
+        """
+        for writer in six.itervalues(self.writers):
+            writer.close()
+
+
+def _render_template(writer, template, values):
+    writer.render(template, *values)
+
+
+class _Indexed(object):
+    def __init__(self, writer, index, uid):
+        self.writer = writer
+        self.index = index
+        self.uid = uid
+
+    def __enter__(self):
+        self.offset = self.writer.tell()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            offset = self.offset
+            self.index.add(self.uid, offset, self.writer.tell() - offset)
+
+
+_INDEX_MAGIC = b"LLICIDX1"
+
+# Magic, number of components, number of hash table slots
+_INDEX_HEADER = struct.Struct(str("<8sQQ"))
+
+# Component offset and length, UID offset (in the index) and length. Empty
+# slots have a UID length of 0.
+_INDEX_SLOT = struct.Struct(str("<QQQI"))
+
+
+def _uid_hash(uid):
+    return zlib.crc32(uid) & 0xffffffff
+
+
+class ComponentIndex(object):
+    """
+    Records the offset and length of components in an iCalendar file by
+    UID (or any other unique text key), to be saved as a sidecar index
+    file for IndexedCalendar. Use with CalendarWriter.indexed(), or add()
+    offsets from CalendarWriter.tell().
+    """
+
+    def __init__(self):
+        self.components = {}
+
+    def add(self, uid, offset, length):
+        """
+        Record a component. A component added with the same uid as an
+        earlier one replaces it.
+        """
+        if isinstance(uid, six.text_type):
+            uid = uid.encode("utf-8")
+        if not uid:
+            raise ValueError("uid must not be empty")
+        self.components[uid] = (offset, length)
+
+    def __len__(self):
+        return len(self.components)
+
+    def save(self, path):
+        """
+        Write the index to path as an open addressed hash table of fixed
+        size slots, followed by the UIDs.
+        """
+        components = self.components
+        slot_count = 1
+        while slot_count < 2 * len(components):
+            slot_count *= 2
+        mask = slot_count - 1
+
+        table = bytearray(_INDEX_HEADER.size + slot_count * _INDEX_SLOT.size)
+        _INDEX_HEADER.pack_into(
+            table, 0, _INDEX_MAGIC, len(components), slot_count)
+        uids = []
+        uid_offset = len(table)
+        for uid, (offset, length) in six.iteritems(components):
+            slot = _uid_hash(uid) & mask
+            while _INDEX_SLOT.unpack_from(
+                    table, _INDEX_HEADER.size + slot * _INDEX_SLOT.size)[3]:
+                slot = (slot + 1) & mask
+            _INDEX_SLOT.pack_into(
+                table, _INDEX_HEADER.size + slot * _INDEX_SLOT.size,
+                offset, length, uid_offset, len(uid))
+            uids.append(uid)
+            uid_offset += len(uid)
+
+        with open(path, "wb") as f:
+            f.write(table)
+            f.write(b"".join(uids))
+
+
+class IndexedCalendar(object):
+    """
+    Random access by UID to the components of an iCalendar file, using
+    an index saved by ComponentIndex. Both files are memory mapped, and
+    looking up a component reads a single index slot (barring collisions)
+    without parsing either file.
+    """
+
+    def __init__(self, path, index_path):
+        self._files = []
+        self._maps = []
+        self._calendar = self._map(path)
+        self._index = index = self._map(index_path)
+
+        magic, self.count, self._slot_count = _INDEX_HEADER.unpack_from(
+            index, 0)
+        if magic != _INDEX_MAGIC:
+            self.close()
+            raise ValueError("Not a component index: {!r}".format(
+                index_path))
+
+    def _map(self, path):
+        f = open(path, "rb")
+        self._files.append(f)
+        f.seek(0, 2)
+        if not f.tell():
+            # Empty files can't be mapped
+            return b""
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def _find(self, uid):
+        if isinstance(uid, six.text_type):
+            uid = uid.encode("utf-8")
+        index = self._index
+        mask = self._slot_count - 1
+        slot = _uid_hash(uid) & mask
+        while True:
+            offset, length, uid_offset, uid_length = _INDEX_SLOT.unpack_from(
+                index, _INDEX_HEADER.size + slot * _INDEX_SLOT.size)
+            if not uid_length:
+                return None
+            if (uid_length == len(uid) and
+                    index[uid_offset:uid_offset + uid_length] == uid):
+                return offset, length
+            slot = (slot + 1) & mask
+
+    def get(self, uid, default=None):
+        """
+        Get the octets of the component with uid.
+        """
+        found = self._find(uid)
+        if found is None:
+            return default
+        offset, length = found
+        return self._calendar[offset:offset + length]
+
+    def __getitem__(self, uid):
+        octets = self.get(uid)
+        if octets is None:
+            raise KeyError(uid)
+        return octets
+
+    def __contains__(self, uid):
+        return self._find(uid) is not None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for mapped in self._maps:
+            mapped.close()
+        for f in self._files:
+            f.close()
+        del self._maps[:], self._files[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# A property parameter: ";NAME=VALUE[,VALUE...]" where values may be quoted
+_PARAM_RE = re.compile(
+    br';([^=;:,"]+)=((?:"[^"]*"|[^";:,]*)(?:,(?:"[^"]*"|[^";:,]*))*)')
+
+
+def unfold_lines(stream, read_size=DEFAULT_READ_SIZE):
+    """
+    Generate the unfolded content lines of an iCalendar stream.
+
+    stream can be any object with a read() method returning bytes, such as
+    a binary file or an mmap. It's read read_size octets at a time, so
+    memory use is bounded by read_size and the longest content line.
+    Lines are generated without their line endings. Both CRLF and bare LF
+    line endings are accepted.
+    """
+    read = stream.read
+    parts = []
+    partial = b""
+
+    while True:
+        chunk = read(read_size)
+        if chunk:
+            lines = (partial + chunk).split(b"\n")
+            partial = lines.pop()
+        else:
+            lines = [partial] if partial else []
+
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if line[:1] in (b" ", b"\t"):
+                parts.append(line[1:])
+            elif line:
+                if parts:
+                    yield b"".join(parts)
+                parts = [line]
+
+        if not chunk:
+            break
+
+    if parts:
+        yield b"".join(parts)
+
+
+def parse_contentline(line):
+    """
+    Split an unfolded content line into a (name, params, value) tuple.
+
+    params is a list of (name, value) pairs. Parameter values are returned
+    as they appear in the line (including any quotes) and the value is not
+    unescaped.
+    """
+    colon = line.find(b":")
+    if colon == -1:
+        raise ValueError("No value in content line: {!r}".format(line))
+
+    semicolon = line.find(b";", 0, colon)
+    if semicolon == -1:
+        return line[:colon], [], line[colon + 1:]
+
+    params = []
+    position = semicolon
+    match_param = _PARAM_RE.match
+    while line[position:position + 1] == b";":
+        match = match_param(line, position)
+        if match is None:
+            raise ValueError(
+                "Invalid parameter at offset {} in content line: {!r}"
+                .format(position, line))
+        params.append(match.groups())
+        position = match.end()
+
+    if line[position:position + 1] != b":":
+        raise ValueError("Invalid content line: {!r}".format(line))
+
+    return line[:semicolon], params, line[position + 1:]
+
+
+def read_contentlines(stream, read_size=DEFAULT_READ_SIZE):
+    """
+    Generate a (name, params, value) tuple for each content line of an
+    iCalendar stream, as parsed by parse_contentline().
+
+    No tree of components is built: the start and end of components are
+    reported as content lines named BEGIN and END.
+    """
+    for line in unfold_lines(stream, read_size):
+        yield parse_contentline(line)
+
+
+# The lines merge_calendars() needs to see, with any folded continuation
+# lines.
+_MERGE_LINE_RE = re.compile(
+    br"^(BEGIN|END|UID|SEQUENCE|LAST-MODIFIED|RECURRENCE-ID|TZID)"
+    br"([;:][^\r\n]*(?:\r?\n[ \t][^\r\n]*)*)",
+    re.MULTILINE | re.IGNORECASE)
+
+_FOLD_RE = re.compile(br"\r?\n[ \t]")
+
+
+def _map_source(source, files):
+    if isinstance(source, six.binary_type):
+        return source
+    if isinstance(source, six.string_types):
+        source = open(source, "rb")
+        files.append(source)
+    source.seek(0, 2)
+    if not source.tell():
+        return b""
+    return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _scan_components(data):
+    """
+    Generate a (name, start, end, properties) tuple for each component of
+    the VCALENDARs in data, where properties maps the names of the
+    component's UID, SEQUENCE, LAST-MODIFIED, RECURRENCE-ID and TZID
+    properties to their (unfolded) values.
+    """
+    depth = 0
+    start = None
+    properties = None
+    for match in _MERGE_LINE_RE.finditer(data):
+        name, line = match.groups()
+        name = name.upper()
+        if b"\n" in line:
+            line = _FOLD_RE.sub(b"", line)
+        if name == b"BEGIN":
+            depth += 1
+            if depth == 2:
+                start = match.start()
+                properties = {}
+        elif name == b"END":
+            if depth == 2:
+                end = data.find(b"\n", match.end())
+                end = len(data) if end == -1 else end + 1
+                yield line[1:].upper(), start, end, properties
+            depth -= 1
+        elif depth == 2:
+            properties[name] = line[line.find(b":") + 1:]
+
+
+def merge_calendars(sources, writer, properties):
+    """
+    Merge the components of several iCalendar sources into one VCALENDAR
+    written to writer.
+
+    sources are file paths, binary files with a fileno() or bytes. Each
+    is memory mapped and scanned without parsing it into objects, and
+    components are copied to the writer unchanged with write_raw(), so
+    sources must be folded and use CRLF line endings. properties is a
+    sequence of (name, value) pairs written as the merged calendar's
+    properties, e.g. VERSION and PRODID.
+
+    Components with the same UID and RECURRENCE-ID are written once: the
+    one with the highest SEQUENCE, then LAST-MODIFIED, is kept (the first
+    seen if they're equal). VTIMEZONEs are written once per TZID, before
+    the other components. Memory use depends on the number of distinct
+    components, not their size.
+    """
+    files = []
+    datas = []
+    try:
+        for source in sources:
+            datas.append(_map_source(source, files))
+
+        # First pass: find the components to keep
+        timezones = collections.OrderedDict()
+        latest = {}
+        kept = [[] for _ in datas]
+        for i, data in enumerate(datas):
+            for name, start, end, props in _scan_components(data):
+                if name == b"VTIMEZONE":
+                    timezones.setdefault(props.get(b"TZID"), (i, start, end))
+                    continue
+
+                uid = props.get(b"UID")
+                if uid is None:
+                    kept[i].append((start, end))
+                    continue
+
+                key = (uid, props.get(b"RECURRENCE-ID"))
+                sequence = props.get(b"SEQUENCE", b"0").strip()
+                version = (int(sequence) if sequence.isdigit() else 0,
+                           props.get(b"LAST-MODIFIED", b""))
+                current = latest.get(key)
+                if current is None or version > current[0]:
+                    latest[key] = (version, i, start, end)
+
+        for version, i, start, end in six.itervalues(latest):
+            kept[i].append((start, end))
+
+        # Second pass: write them, in their original order
+        writer.begin("VCALENDAR")
+        for name, value in properties:
+            writer.contentline(name, value)
+        for i, start, end in six.itervalues(timezones):
+            writer.write_raw(datas[i][start:end])
+        for data, ranges in zip(datas, kept):
+            ranges.sort()
+            for start, end in ranges:
+                writer.write_raw(data[start:end])
+        writer.end("VCALENDAR")
+    finally:
+        for data in datas:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for f in files:
+            f.close()
+
+
+_LINT_BARE_CR_RE = re.compile(br"\r(?!\n)")
+
+_LINT_BARE_LF_RE = re.compile(br"(?<!\r)\n")
+
+_LINT_EMPTY_LINE_RE = re.compile(br"\n\r\n")
+
+# Tabs are allowed in values and folds, CR and LF are checked separately
+_LINT_CONTROL_CHARS = b"".join(
+    six.int2byte(c) for c in range(0x0, 0x20) if c not in (0x09, 0x0A, 0x0D)
+) + b"\x7f"
+
+_LINT_CONTROL_CHARS_RE = re.compile(
+    b"[" + re.escape(_LINT_CONTROL_CHARS) + b"]")
+
+_LINT_DELETED = _LINT_CONTROL_CHARS + b"\r\n"
+
+_LINT_SPLIT_UTF8_RE = re.compile(br"\r\n[ \t][\x80-\xbf]")
+
+_LINT_COMPONENT_RE = re.compile(br"\n(BEGIN|END):([^\r\n]*)", re.IGNORECASE)
+
+_LINT_FOLD_RE = re.compile(br"\r\n[ \t]")
+
+# Valid UTF-8 sequences of two to four octets are all non-ASCII, so runs
+# of non-ASCII octets can be checked on their own.
+_LINT_NON_ASCII_RE = re.compile(br"[\x80-\xff]+")
+
+_LINT_UTF8_SEQUENCE = (
+    br"(?:[\xc2-\xdf][\x80-\xbf]|\xe0[\xa0-\xbf][\x80-\xbf]|"
+    br"[\xe1-\xec\xee\xef][\x80-\xbf]{2}|\xed[\x80-\x9f][\x80-\xbf]|"
+    br"\xf0[\x90-\xbf][\x80-\xbf]{2}|[\xf1-\xf3][\x80-\xbf]{3}|"
+    br"\xf4[\x80-\x8f][\x80-\xbf]{2})")
+
+# Matches valid sequences, or (as group 1) runs of octets which aren't
+# part of one.
+_LINT_INVALID_UTF8_RE = re.compile(
+    _LINT_UTF8_SEQUENCE + br"+|((?:(?!" + _LINT_UTF8_SEQUENCE +
+    br")[\x80-\xff])+)")
+
+# Amount of data checked at a time
+_LINT_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def _lint_chunks(data, chunk_size=_LINT_CHUNK_SIZE):
+    """
+    Generate (offset, chunk) pairs splitting data into chunks which start
+    with the line ending (CRLF, or a bare LF) of an unfolded, non-empty
+    line, so no line, fold or valid UTF-8 sequence is split between
+    chunks.
+    """
+    def line_end(newline):
+        # The offset of the line ending at newline, or -1 if it isn't a
+        # chunk boundary
+        position = newline
+        if data[newline - 1:newline] == b"\r":
+            position -= 1
+        if (data[newline + 1:newline + 2] in (b" ", b"\t") or
+                data[position - 1:position] == b"\n"):
+            return -1
+        return position
+
+    start = 0
+    data_length = len(data)
+    while start < data_length:
+        end = start + chunk_size
+        if end < data_length:
+            boundary = -1
+            newline = data.rfind(b"\n", start + 2, end + 1)
+            while newline != -1 and boundary == -1:
+                boundary = line_end(newline)
+                newline = data.rfind(b"\n", start + 2, newline)
+            if boundary == -1:
+                # The chunk is within a line, so extend it to the line end
+                newline = data.find(b"\n", end + 1)
+                while newline != -1 and boundary == -1:
+                    boundary = line_end(newline)
+                    newline = data.find(b"\n", newline + 1)
+            end = data_length if boundary == -1 else boundary
+        yield start, data[start:end]
+        start = end
+
+
+def _lint_utf8(chunk):
+    """
+    Generate the offset in chunk, which isn't valid UTF-8, of each run of
+    octets which aren't part of a valid UTF-8 sequence, ignoring folds.
+    """
+    folds = [m.start() for m in _LINT_FOLD_RE.finditer(chunk)]
+    unfolded = _LINT_FOLD_RE.sub(b"", chunk) if folds else chunk
+    try:
+        unfolded.decode("utf-8")
+        return
+    except UnicodeDecodeError as e:
+        first_error = e.start
+
+    # The offset in unfolded of each fold
+    fold_offsets = [offset - 3 * i for i, offset in enumerate(folds)]
+    folds_before = 0
+    for run in _LINT_NON_ASCII_RE.finditer(unfolded, first_error):
+        octets = run.group()
+        try:
+            octets.decode("utf-8")
+            continue
+        except UnicodeDecodeError:
+            pass
+        for match in _LINT_INVALID_UTF8_RE.finditer(octets):
+            if match.lastindex is None:
+                continue
+            error = run.start() + match.start(1)
+            while (folds_before < len(fold_offsets) and
+                   fold_offsets[folds_before] <= error):
+                folds_before += 1
+            yield error + 3 * folds_before
+
+
+def _lint_name(name):
+    return name.decode("utf-8", "replace")
+
+
+def lint(source, line_length=DEFAULT_ICAL_LINE_LENGTH,
+         chunk_size=_LINT_CHUNK_SIZE):
+    """
+    Check that an iCalendar file is well formed, returning a list of
+    (offset, message) pairs describing the problems found, in order of
+    their offset in the file.
+
+    source is a file path, a binary file with a fileno() or bytes. Files
+    are memory mapped and checked in large chunks with bytes methods and
+    regular expressions, rather than line by line. The checks are: lines
+    of at most line_length octets, CRLF line endings, no empty lines, no
+    fold at the start of the file, no control characters, valid UTF-8
+    (ignoring folds), no folds inside UTF-8 sequences and balanced
+    BEGIN/END lines. Around chunk_size octets are checked at a time.
+    """
+    long_line = "Line longer than {} octets".format(line_length)
+    long_line_re = re.compile(
+        r"\n[^\r\n]{{{}}}".format(line_length + 1).encode("ascii"))
+    # Lines ending in CRLF which are too long have line_length + 2 octets
+    # which aren't LF. Repeating a single excluded octet is much faster
+    # than a set of them.
+    long_crlf_line_re = re.compile(
+        r"\n[^\n]{{{}}}".format(line_length + 2).encode("ascii"))
+    first_long_line_re = re.compile(
+        r"[^\r\n]{{{}}}".format(line_length + 1).encode("ascii"))
+
+    files = []
+    data = b""
+    try:
+        data = _map_source(source, files)
+        problems = []
+        add = problems.append
+
+        if data[:1] in (b" ", b"\t"):
+            add((0, "Fold at start of file"))
+        if data[:2] == b"\r\n":
+            add((0, "Empty line"))
+        if first_long_line_re.match(data):
+            add((0, long_line))
+
+        components = []
+        for offset, chunk in _lint_chunks(data, chunk_size):
+            crlfs = chunk.count(b"\r\n")
+            # One pass finds chunks with no bare CRs or LFs and no control
+            # characters, which is nearly all of them.
+            clean = (len(chunk) - len(chunk.translate(None, _LINT_DELETED)) ==
+                     2 * crlfs)
+            bare_lfs = not clean and chunk.count(b"\n") != crlfs
+            # The last line isn't followed by its CR in the chunk
+            if (bare_lfs or long_crlf_line_re.search(chunk) or
+                    long_line_re.search(chunk, chunk.rfind(b"\n"))):
+                for match in long_line_re.finditer(chunk):
+                    add((offset + match.start() + 1, long_line))
+
+            if not clean:
+                if chunk.count(b"\r") != crlfs:
+                    for match in _LINT_BARE_CR_RE.finditer(chunk):
+                        add((offset + match.start(), "Bare CR"))
+                if bare_lfs:
+                    for match in _LINT_BARE_LF_RE.finditer(chunk):
+                        add((offset + match.start(), "Bare LF"))
+                for match in _LINT_CONTROL_CHARS_RE.finditer(chunk):
+                    add((offset + match.start(), "Control character"))
+            if b"\n\r\n" in chunk:
+                for match in _LINT_EMPTY_LINE_RE.finditer(chunk):
+                    add((offset + match.start() + 1, "Empty line"))
+            try:
+                chunk.decode("utf-8")
+            except UnicodeDecodeError:
+                # A fold inside a UTF-8 sequence makes the chunk invalid
+                for match in _LINT_SPLIT_UTF8_RE.finditer(chunk):
+                    add((offset + match.start(),
+                         "Fold splits a multi-octet UTF-8 sequence"))
+                for error in _lint_utf8(chunk):
+                    add((offset + error, "Invalid UTF-8"))
+
+            # Each chunk but the first starts with a line ending
+            if not offset:
+                chunk = b"\n" + chunk
+                offset = -1
+
+            # Check the nesting without match objects first, as offsets
+            # are only needed for problems
+            nested = components[:]
+            for keyword, name in _LINT_COMPONENT_RE.findall(chunk):
+                if len(keyword) == 5:
+                    nested.append(name.upper())
+                elif nested and (nested[-1] == name or
+                                 nested[-1] == name.upper()):
+                    nested.pop()
+                else:
+                    break
+            else:
+                components = nested
+                continue
+
+            for match in _LINT_COMPONENT_RE.finditer(chunk):
+                name = match.group(2).upper()
+                if len(match.group(1)) == 5:
+                    components.append(name)
+                elif components and components[-1] == name:
+                    components.pop()
+                elif name in components:
+                    # End the components left open inside it too, so one
+                    # missing END isn't reported for every later END
+                    while components[-1] != name:
+                        add((offset + match.start() + 1,
+                             "BEGIN:{} not ended".format(
+                                 _lint_name(components.pop()))))
+                    components.pop()
+                else:
+                    name = _lint_name(name)
+                    add((offset + match.start() + 1,
+                         "END:{} without BEGIN:{}".format(name, name)))
+
+        for name in components:
+            add((len(data), "BEGIN:{} not ended".format(_lint_name(name))))
+
+        problems.sort()
+        return problems
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
+        for f in files:
+            f.close()
+
+
+def lint_main(argv=None):
+    """
+    Command line interface to lint(): llic-lint FILE...
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Check that iCalendar files are well formed.")
+    parser.add_argument("files", nargs="+", metavar="FILE")
+    parser.add_argument(
+        "--line-length", type=int, default=DEFAULT_ICAL_LINE_LENGTH,
+        help="Maximum line length in octets (default: {})".format(
+            DEFAULT_ICAL_LINE_LENGTH))
+    args = parser.parse_args(argv)
+
+    status = 0
+    for path in args.files:
+        for offset, message in lint(path, args.line_length):
+            print("{}:{}: {}".format(path, offset, message))
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(lint_main())
@@ -36,6 +36,14 @@ setup(
         "pytz",
         "six"
     ],
+    extras_require={
+        "numpy": ["numpy"]
+    },
+    entry_points={
+        "console_scripts": [
+            "llic-lint = llic:lint_main"
+        ]
+    },
     license="BSD",
     zip_safe=False,
     classifiers=[
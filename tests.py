@@ -1,16 +1,63 @@
 from __future__ import unicode_literals
 
+import base64
 import datetime
+import gzip
+import hashlib
+import os
 import re
+import shutil
+import tempfile
 import unittest
+import zlib
 
-from mock import MagicMock, sentinel
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    from concurrent import futures
+except ImportError:
+    futures = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from mock import ANY, MagicMock, patch, sentinel
 import pytz
 import six
 
 from llic import(
+    AsyncCalendarWriter,
     CalendarWriter,
-    TypesCalendarWriterHelperMixin
+    ComponentCache,
+    ComponentIndex,
+    ComponentTemplate,
+    CompressedOutput,
+    FanOut,
+    FeedDigest,
+    FileDescriptorOutput,
+    HashingOutput,
+    IndexedCalendar,
+    InstrumentedCalendarWriter,
+    LRUCache,
+    TypesCalendarWriterHelperMixin,
+    ValidatingCalendarWriter,
+    ValidationError,
+    _lint_chunks,
+    encode_param_value,
+    encode_vtimezone,
+    iter_chunks,
+    lint,
+    lint_main,
+    merge_calendars,
+    render_parallel,
+    parse_contentline,
+    read_contentlines,
+    unfold_lines
 )
 
 
@@ -65,6 +112,46 @@ class TestCalendarWriter(unittest.TestCase):
         self.assertEqual(max(len(l) for l in lines), 75)
         self.assertFalse(value.endswith(b"\r\n "))
 
+    def test_write_wrap_does_not_split_utf8_sequences(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out)
+
+        for message in ["\u65e5\u672c\u8a9e" * 40, "\xe9t\xe9 " * 60,
+                        "\U0001f600" * 50, "x" + "\U0001f600" * 50]:
+            out.seek(0)
+            out.truncate()
+            writer.line_position = 0
+            writer.contentline("SUMMARY", message)
+
+            lines = out.getvalue().split(b"\r\n")
+            for line in lines:
+                self.assertTrue(len(line) <= 75)
+                line.decode("utf-8")
+            self.assertEqual(
+                "SUMMARY:" + message,
+                b"".join(l[1:] if i else l for i, l in enumerate(lines))
+                .decode("utf-8"))
+
+    def test_write_wrap_updates_line_position(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, line_length=10)
+
+        writer.write("abcdefghijklm")
+        writer.write("nopqrstuvwxyz")
+
+        self.assertEqual(
+            b"abcdefghij\r\n klmnopqrs\r\n tuvwxyz", out.getvalue())
+        self.assertEqual(8, writer.line_position)
+
+    def test_write_wrap_non_utf8_octets(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, line_length=10)
+
+        writer.write(b"\x80" * 12)
+
+        self.assertEqual(b"\x80" * 10 + b"\r\n " + b"\x80" * 2,
+                         out.getvalue())
+
     def test_write_start_contenetline(self):
         out = six.BytesIO()
         writer = CalendarWriter(out)
@@ -82,6 +169,59 @@ class TestCalendarWriter(unittest.TestCase):
         self.assertEqual(out.getvalue(), b"\r\n")
 
 
+class TestBufferedCalendarWriter(unittest.TestCase):
+    def test_writes_are_buffered(self):
+        mock_out = MagicMock()
+        writer = CalendarWriter(mock_out, buffer_size=1024)
+
+        writer.contentline("SUMMARY", "Foo")
+
+        self.assertFalse(mock_out.write.called)
+
+    def test_buffer_is_flushed_at_threshold(self):
+        mock_out = MagicMock()
+        writer = CalendarWriter(mock_out, buffer_size=10)
+
+        writer.contentline("SUMMARY", "Foo")
+        writer.contentline("UID", "1")
+
+        mock_out.write.assert_called_once_with(b"SUMMARY:Foo\r\n")
+
+    def test_flush(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, buffer_size=1024)
+
+        writer.contentline("SUMMARY", "Foo")
+        self.assertEqual(b"", out.getvalue())
+        writer.flush()
+
+        self.assertEqual(b"SUMMARY:Foo\r\n", out.getvalue())
+
+    def test_close_flushes_and_closes_output(self):
+        mock_out = MagicMock()
+
+        with CalendarWriter(mock_out, buffer_size=1024) as writer:
+            writer.contentline("SUMMARY", "Foo")
+
+        mock_out.write.assert_called_once_with(b"SUMMARY:Foo\r\n")
+        mock_out.close.assert_called_once_with()
+
+    def test_folding_matches_unbuffered_output(self):
+        message = "Lorem ipsum dolor sit amet, " * 20
+        unbuffered, buffered = six.BytesIO(), six.BytesIO()
+
+        CalendarWriter(unbuffered).contentline("DESCRIPTION", message)
+        writer = CalendarWriter(buffered, buffer_size=16)
+        writer.contentline("DESCRIPTION", message)
+        writer.flush()
+
+        self.assertEqual(unbuffered.getvalue(), buffered.getvalue())
+
+    def test_buffer_size_must_be_positive(self):
+        self.assertRaises(ValueError, CalendarWriter, six.BytesIO(),
+                          buffer_size=0)
+
+
 class TestCalendarWriterHelperMixin(unittest.TestCase):
     def test_contentline(self):
         writer = CalendarWriter(six.BytesIO())
@@ -122,6 +262,140 @@ class TestCalendarWriterHelperMixin(unittest.TestCase):
         writer.value.assert_called_once_with(sentinel.section)
         writer.end_contentline.assert_called_once()
 
+    def test_start_contentline_override_without_params(self):
+        class Writer(CalendarWriter):
+            def start_contentline(self, name):
+                super(Writer, self).start_contentline(name.upper())
+
+        out = six.BytesIO()
+        writer = Writer(out)
+        writer.begin("VCALENDAR")
+        writer.contentline("version", "2.0")
+        writer.end("VCALENDAR")
+
+        self.assertEqual(
+            b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nEND:VCALENDAR\r\n",
+            out.getvalue())
+
+
+class TestBinaryContentline(unittest.TestCase):
+    data = bytes(bytearray(range(256))) * 40
+
+    def write(self, data, line_length=75, **kwargs):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, line_length=line_length)
+        writer.binary_contentline("ATTACH", data, **kwargs)
+        return out.getvalue()
+
+    def test_binary_contentline(self):
+        expected = six.BytesIO()
+        CalendarWriter(expected).contentline(
+            "ATTACH", base64.b64encode(self.data),
+            [("ENCODING", "BASE64"), ("VALUE", "BINARY"),
+             ("FMTTYPE", "image/png")])
+
+        self.assertEqual(expected.getvalue(), self.write(
+            self.data, params=[("FMTTYPE", "image/png")], block_size=100))
+
+    def test_data_sources(self):
+        expected = self.write(self.data)
+        chunks = [self.data[i:i + 1000]
+                  for i in range(0, len(self.data), 1000)]
+
+        self.assertEqual(expected, self.write(six.BytesIO(self.data)))
+        self.assertEqual(expected, self.write(iter(chunks), block_size=1))
+        self.assertEqual(expected, self.write(chunks, block_size=4000))
+
+    def test_short_line_length(self):
+        octets = self.write(self.data, line_length=4)
+        self.assertTrue(all(len(line) <= 4 for line in octets.split(b"\r\n")))
+        self.assertEqual(self.data, base64.b64decode(
+            octets.replace(b"\r\n ", b"").split(b":")[1]))
+
+    def test_empty_value(self):
+        self.assertEqual(b"ATTACH;ENCODING=BASE64;VALUE=BINARY:\r\n",
+                         self.write(b""))
+
+    def test_validating_writer(self):
+        writer = ValidatingCalendarWriter(six.BytesIO())
+        writer.begin("VCALENDAR")
+        writer.binary_contentline("ATTACH", iter([b"abc", b"def"]))
+        writer.binary_contentline("ATTACH", b"")
+
+
+class TestContentlineParams(unittest.TestCase):
+    def setUp(self):
+        self.out = six.BytesIO()
+        self.writer = CalendarWriter(self.out)
+
+    def test_params(self):
+        self.writer.contentline(
+            "ORGANIZER", "MAILTO:john.doe@example.com",
+            [("CN", "John Doe"), ("ROLE", "CHAIR")])
+
+        self.assertEqual(
+            b"ORGANIZER;CN=John Doe;ROLE=CHAIR:MAILTO:john.doe@example.com"
+            b"\r\n",
+            self.out.getvalue())
+
+    def test_params_mapping(self):
+        self.writer.contentline("DTSTART", "20130621T120000",
+                                {"TZID": "Europe/London"})
+
+        self.assertEqual(b"DTSTART;TZID=Europe/London:20130621T120000\r\n",
+                         self.out.getvalue())
+
+    def test_multi_valued_params_are_not_cached(self):
+        params = [("MEMBER", ["mailto:a@example.com", "mailto:b@example.com"])]
+        self.writer.contentline("ATTENDEE", "c@ex", params)
+
+        self.assertEqual(
+            b'ATTENDEE;MEMBER="mailto:a@example.com","mailto:b@example.com"'
+            b":c@ex\r\n",
+            self.out.getvalue())
+        self.assertEqual(0, len(self.writer.param_cache))
+
+    def test_params_iterator_with_unhashable_values(self):
+        params = [("ROLE", "CHAIR"), ("MEMBER", ["a", "b"])]
+        self.writer.contentline("ATTENDEE", "c@ex", iter(params))
+
+        self.assertEqual(b"ATTENDEE;ROLE=CHAIR;MEMBER=a,b:c@ex\r\n",
+                         self.out.getvalue())
+
+    def test_prefix_is_cached(self):
+        params = [("CN", "John Doe")]
+        self.writer.contentline("ORGANIZER", "MAILTO:a@example.com", params)
+        self.writer.contentline("ORGANIZER", "MAILTO:a@example.com", params)
+
+        self.assertEqual(1, self.writer.param_cache.hits)
+        self.assertEqual(1, self.writer.param_cache.misses)
+
+    def test_cache_hit_is_a_single_write(self):
+        mock_out = MagicMock()
+        writer = CalendarWriter(mock_out)
+        writer.start_contentline("ORGANIZER", [("CN", "John Doe")])
+
+        mock_out.write.assert_called_once_with(b"ORGANIZER;CN=John Doe:")
+
+
+class TestEncodeParamValue(unittest.TestCase):
+    def test_plain_value(self):
+        self.assertEqual(b"John Doe", encode_param_value("John Doe"))
+
+    def test_values_with_special_chars_are_quoted(self):
+        for value in ["a:b", "a;b", "a,b"]:
+            self.assertEqual(b'"' + value.encode("ascii") + b'"',
+                             encode_param_value(value))
+
+    def test_rfc_6868_escaping(self):
+        self.assertEqual(b"^^ ^' ^n", encode_param_value('^ " \n'))
+
+    def test_control_chars_are_removed(self):
+        self.assertEqual(b"a\tb", encode_param_value("a\x00\tb\x7f"))
+
+    def test_multiple_values(self):
+        self.assertEqual(b'a,"b,c"', encode_param_value(["a", "b,c"]))
+
 
 class TypesTestMixin(object):
     """
@@ -162,6 +436,57 @@ class TestAsTest(TypesTestMixin, unittest.TestCase):
 
         self.assertEqual(b"", self.instance.as_text(low_chars))
 
+    def test_text_without_special_chars_is_unchanged(self):
+        self.assertEqual(b"Bastille Day Party",
+                         self.instance.as_text("Bastille Day Party"))
+
+    def test_mixed_special_chars(self):
+        self.assertEqual(b"a\\\\b\\nc\\;d\\,e",
+                         self.instance.as_text("a\\b\nc;d,e\x07"))
+
+    def test_text_cache(self):
+        self.instance.text_cache = LRUCache(10)
+
+        first = self.instance.as_text("Foo, bar")
+        second = self.instance.as_text("Foo, bar")
+
+        self.assertEqual(b"Foo\\, bar", second)
+        self.assertIs(first, second)
+        self.assertEqual(1, self.instance.text_cache.hits)
+        self.assertEqual(1, self.instance.text_cache.misses)
+
+    def test_text_cache_can_be_passed_to_writer(self):
+        cache = LRUCache(10)
+        writer = CalendarWriter(six.BytesIO(), text_cache=cache)
+
+        writer.as_text("Foo")
+
+        self.assertIn("Foo", cache)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_least_recently_used_item_is_evicted(self):
+        cache = LRUCache(2)
+        cache["a"] = 1
+        cache["b"] = 2
+        cache.get("a")
+        cache["c"] = 3
+
+        self.assertEqual(2, len(cache))
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+
+    def test_hits_and_misses_are_counted(self):
+        cache = LRUCache(2)
+        cache["a"] = 1
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_maxsize_must_be_positive(self):
+        self.assertRaises(ValueError, LRUCache, 0)
+
 
 class TestAsDate(TypesTestMixin, unittest.TestCase, BackportTestCaseMixin):
     def test_naive_date_raises_value_error(self):
@@ -183,7 +508,7 @@ class TestAsDate(TypesTestMixin, unittest.TestCase, BackportTestCaseMixin):
         """
         dt = pytz.utc.localize(datetime.datetime(2013, 6, 21, 12, 0))
         encoded = self.instance.as_datetime(dt)
-        self.assertRegex(encoded, "[zZ]$")
+        self.assertRegex(encoded, b"[zZ]$")
 
     def test_datetimes_are_converted_to_utc(self):
         """
@@ -194,4 +519,1292 @@ class TestAsDate(TypesTestMixin, unittest.TestCase, BackportTestCaseMixin):
         # In BST, so UTC+1
         dt = zone.localize(datetime.datetime(2013, 6, 21, 12, 0))
         encoded = self.instance.as_datetime(dt)
-        self.assertEqual("20130621T110000Z", encoded)
+        self.assertEqual(b"20130621T110000Z", encoded)
+
+    def test_encoded_dates_are_zero_padded(self):
+        dt = pytz.utc.localize(datetime.datetime(987, 1, 2, 3, 4, 5))
+        self.assertEqual(b"09870102T030405Z", self.instance.as_datetime(dt))
+
+    def test_encoded_dates_are_cached(self):
+        zone = pytz.timezone("Europe/London")
+        dt = zone.localize(datetime.datetime(2013, 6, 21, 12, 0))
+
+        self.assertIs(self.instance.as_datetime(dt),
+                      self.instance.as_datetime(dt))
+
+    def test_cache_is_bounded(self):
+        self.instance.datetime_cache_size = 2
+        for hour in range(5):
+            self.instance.as_datetime(
+                pytz.utc.localize(datetime.datetime(2013, 6, 21, hour)))
+
+        self.assertTrue(len(self.instance._datetime_cache) <= 2)
+
+
+class TestAsTimestamp(TypesTestMixin, unittest.TestCase):
+    def test_epoch(self):
+        self.assertEqual(b"19700101T000000Z", self.instance.as_timestamp(0))
+
+    def test_timestamp(self):
+        self.assertEqual(b"20130621T110000Z",
+                         self.instance.as_timestamp(1371812400))
+
+    def test_negative_timestamp(self):
+        self.assertEqual(b"19691231T235959Z", self.instance.as_timestamp(-1))
+
+    def test_matches_as_datetime(self):
+        dt = pytz.utc.localize(datetime.datetime(2016, 2, 29, 23, 59, 58))
+        timestamp = (dt - pytz.utc.localize(
+            datetime.datetime(1970, 1, 1))).total_seconds()
+
+        self.assertEqual(self.instance.as_datetime(dt),
+                         self.instance.as_timestamp(timestamp))
+
+
+class TestValueEncoders(TypesTestMixin, unittest.TestCase):
+    start = pytz.utc.localize(datetime.datetime(2015, 7, 1, 9, 30))
+
+    def test_as_date(self):
+        self.assertEqual(b"00990102",
+                         self.instance.as_date(datetime.date(99, 1, 2)))
+        self.assertEqual(b"20150701", self.instance.as_date(self.start))
+
+    def test_as_duration(self):
+        cases = [
+            (datetime.timedelta(0), b"PT0S"),
+            (datetime.timedelta(weeks=3), b"P3W"),
+            (datetime.timedelta(days=8), b"P8D"),
+            (datetime.timedelta(minutes=90), b"PT1H30M"),
+            (datetime.timedelta(days=1, seconds=5), b"P1DT5S"),
+            (datetime.timedelta(minutes=-15), b"-PT15M"),
+        ]
+        for duration, expected in cases:
+            self.assertEqual(expected, self.instance.as_duration(duration))
+
+    def test_as_period(self):
+        self.assertEqual(
+            b"20150701T093000Z/20150701T103000Z",
+            self.instance.as_period(
+                self.start, self.start + datetime.timedelta(hours=1)))
+        self.assertEqual(
+            b"20150701T093000Z/PT1H",
+            self.instance.as_period(self.start, datetime.timedelta(hours=1)))
+
+    def test_as_recur(self):
+        self.assertEqual(
+            b"FREQ=WEEKLY;COUNT=10;BYDAY=MO,WE;WKST=SU",
+            self.instance.as_recur("weekly", count=10, byday=["MO", "WE"],
+                                   wkst="SU"))
+        self.assertEqual(
+            b"FREQ=MONTHLY;UNTIL=20151231;INTERVAL=2;BYMONTHDAY=1",
+            self.instance.as_recur("MONTHLY", datetime.date(2015, 12, 31),
+                                   interval=2, bymonthday=1))
+        self.assertEqual(
+            b"FREQ=DAILY;UNTIL=20150701T093000Z",
+            self.instance.as_recur("DAILY", until=self.start))
+
+    def test_as_recur_bytes_values(self):
+        self.assertEqual(
+            b"FREQ=YEARLY;BYDAY=MO,1SU;BYMONTH=3",
+            self.instance.as_recur(b"YEARLY", byday=[b"MO", "1SU"],
+                                   bymonth=b"3"))
+
+    def test_as_recur_until_and_count_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.instance.as_recur("DAILY", until=self.start, count=1)
+
+    def test_as_list(self):
+        dates = [self.start + datetime.timedelta(days=n) for n in range(3)]
+        self.assertEqual(
+            b"20150701T093000Z,20150702T093000Z,20150703T093000Z",
+            self.instance.as_list(dates, self.instance.as_datetime))
+        self.assertEqual(
+            b"a\\,b,c",
+            self.instance.as_list(["a,b", "c"], self.instance.as_text))
+        self.assertEqual(b"A,B", self.instance.as_list(["A", b"B"]))
+
+
+class TestAsLocalDatetime(TypesTestMixin, unittest.TestCase):
+    london = pytz.timezone("Europe/London")
+
+    def test_datetimes_are_not_converted_to_utc(self):
+        dt = self.london.localize(datetime.datetime(2015, 7, 1, 9, 30))
+        self.assertEqual(b"20150701T093000",
+                         self.instance.as_local_datetime(dt))
+
+    def test_timezone_must_be_a_pytz_timezone(self):
+        with self.assertRaises(ValueError):
+            self.instance.as_local_datetime(datetime.datetime(2015, 7, 1))
+
+    def test_years_used_are_recorded(self):
+        for year in [2015, 2013, 2014]:
+            self.instance.as_local_datetime(
+                self.london.localize(datetime.datetime(year, 7, 1)))
+        self.assertEqual({"Europe/London": (2013, 2015)},
+                         self.instance.timezone_years)
+
+
+class TestTimezones(unittest.TestCase):
+    london = pytz.timezone("Europe/London")
+
+    def test_datetime_contentline_has_tzid(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out)
+        writer.datetime_contentline(
+            "DTSTART", self.london.localize(datetime.datetime(2015, 7, 1)))
+        writer.datetime_contentline(
+            "DTEND", pytz.utc.localize(datetime.datetime(2015, 7, 1, 1)))
+
+        self.assertEqual(
+            b"DTSTART;TZID=Europe/London:20150701T000000\r\n"
+            b"DTEND:20150701T010000Z\r\n",
+            out.getvalue())
+
+    def test_encode_vtimezone(self):
+        self.assertEqual(
+            b"BEGIN:VTIMEZONE\r\n"
+            b"TZID:Europe/London\r\n"
+            b"BEGIN:STANDARD\r\n"
+            b"DTSTART:20141026T020000\r\n"
+            b"TZOFFSETFROM:+0100\r\n"
+            b"TZOFFSETTO:+0000\r\n"
+            b"TZNAME:GMT\r\n"
+            b"END:STANDARD\r\n"
+            b"BEGIN:DAYLIGHT\r\n"
+            b"DTSTART:20150329T010000\r\n"
+            b"TZOFFSETFROM:+0000\r\n"
+            b"TZOFFSETTO:+0100\r\n"
+            b"TZNAME:BST\r\n"
+            b"END:DAYLIGHT\r\n"
+            b"BEGIN:STANDARD\r\n"
+            b"DTSTART:20151025T020000\r\n"
+            b"TZOFFSETFROM:+0100\r\n"
+            b"TZOFFSETTO:+0000\r\n"
+            b"TZNAME:GMT\r\n"
+            b"END:STANDARD\r\n"
+            b"END:VTIMEZONE\r\n",
+            encode_vtimezone(self.london, 2015, 2015))
+
+    def test_vtimezone_after_transition_tables_has_rrules(self):
+        self.assertEqual(
+            b"BEGIN:VTIMEZONE\r\n"
+            b"TZID:America/New_York\r\n"
+            b"BEGIN:DAYLIGHT\r\n"
+            b"DTSTART:20370308T020000\r\n"
+            b"TZOFFSETFROM:-0500\r\n"
+            b"TZOFFSETTO:-0400\r\n"
+            b"TZNAME:EDT\r\n"
+            b"RRULE:FREQ=YEARLY;BYDAY=2SU;BYMONTH=3\r\n"
+            b"END:DAYLIGHT\r\n"
+            b"BEGIN:STANDARD\r\n"
+            b"DTSTART:20371101T020000\r\n"
+            b"TZOFFSETFROM:-0400\r\n"
+            b"TZOFFSETTO:-0500\r\n"
+            b"TZNAME:EST\r\n"
+            b"RRULE:FREQ=YEARLY;BYDAY=1SU;BYMONTH=11\r\n"
+            b"END:STANDARD\r\n"
+            b"END:VTIMEZONE\r\n",
+            encode_vtimezone("America/New_York", 2040, 2040))
+
+        london = encode_vtimezone(self.london, 2036, 2040)
+        self.assertIn(b"DTSTART:20361026T020000\r\n", london)
+        self.assertIn(b"RRULE:FREQ=YEARLY;BYDAY=-1SU;BYMONTH=3\r\n", london)
+        self.assertIn(b"RRULE:FREQ=YEARLY;BYDAY=-1SU;BYMONTH=10\r\n", london)
+
+    def test_vtimezone_rule_past_end_of_month_raises_value_error(self):
+        # The last Thursday of October at 24:00 can be 1st November
+        with self.assertRaises(ValueError):
+            encode_vtimezone("Africa/Cairo", 2040, 2045)
+        self.assertIn(b"TZNAME:EEST\r\n",
+                      encode_vtimezone("Africa/Cairo", 2030, 2030))
+
+    def test_vtimezone_rrule_weekday_on_or_after(self):
+        self.assertIn(
+            b"RRULE:FREQ=YEARLY;BYDAY=FR;BYMONTH=3;"
+            b"BYMONTHDAY=23,24,25,26,27,28,29\r\n",
+            encode_vtimezone("Asia/Jerusalem", 2040, 2040))
+        self.assertIn(
+            b"RRULE:FREQ=YEARLY;BYDAY=SU;BYMONTH=9;"
+            b"BYMONTHDAY=2,3,4,5,6,7,8\r\n",
+            encode_vtimezone("America/Santiago", 2040, 2040))
+
+    def test_fixed_offset_timezone(self):
+        self.assertIn(b"TZOFFSETFROM:-0500\r\nTZOFFSETTO:-0500\r\n",
+                      encode_vtimezone("Etc/GMT+5", 2015, 2015))
+
+    def test_encoded_vtimezones_are_cached(self):
+        self.assertIs(encode_vtimezone("Asia/Tokyo", 2000, 2010),
+                      encode_vtimezone("Asia/Tokyo", 2000, 2010))
+
+    def test_vtimezones_cover_the_years_used(self):
+        out = six.BytesIO()
+        writer = ValidatingCalendarWriter(out)
+        writer.begin("VCALENDAR")
+        writer.contentline("VERSION", "2.0")
+        writer.contentline("PRODID", "-//Example//EN")
+        for year in [2013, 2015]:
+            writer.begin("VEVENT")
+            writer.contentline("UID", "{}@example.com".format(year))
+            writer.contentline("DTSTAMP", "20150101T000000Z")
+            writer.datetime_contentline("DTSTART", self.london.localize(
+                datetime.datetime(year, 7, 1)))
+            writer.end("VEVENT")
+        writer.vtimezones()
+        writer.end("VCALENDAR")
+
+        self.assertIn(encode_vtimezone(self.london, 2013, 2015),
+                      out.getvalue())
+
+
+class TestComponentTemplate(unittest.TestCase):
+    def setUp(self):
+        self.template = ComponentTemplate("VEVENT")
+        self.template.slot("UID")
+        self.template.slot("DTSTART", "as_datetime")
+        self.template.contentline("ORGANIZER;CN=John Doe",
+                                  "MAILTO:john.doe@example.com")
+        self.template.slot("SUMMARY", "as_text")
+
+        self.start = pytz.utc.localize(datetime.datetime(2013, 6, 21, 12, 0))
+
+    def write_event(self, writer, uid, start, summary):
+        writer.begin("VEVENT")
+        writer.contentline("UID", uid)
+        writer.contentline("DTSTART", writer.as_datetime(start))
+        writer.contentline("ORGANIZER;CN=John Doe",
+                           "MAILTO:john.doe@example.com")
+        writer.contentline("SUMMARY", writer.as_text(summary))
+        writer.end("VEVENT")
+
+    def test_render_matches_contentlines(self):
+        summary = "A long, folded summary; " * 10
+        expected, actual = six.BytesIO(), six.BytesIO()
+
+        self.write_event(CalendarWriter(expected), "uid1", self.start,
+                         summary)
+        CalendarWriter(actual).render(self.template, "uid1", self.start,
+                                      summary)
+
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_render_with_short_line_length(self):
+        expected, actual = six.BytesIO(), six.BytesIO()
+
+        self.write_event(CalendarWriter(expected, line_length=10),
+                         "uid1", self.start, "Foo")
+        CalendarWriter(actual, line_length=10).render(
+            self.template, "uid1", self.start, "Foo")
+
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_render_buffered(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, buffer_size=16)
+
+        writer.render(self.template, "uid1", self.start, "Foo")
+        writer.flush()
+
+        self.assertEqual(
+            b"BEGIN:VEVENT\r\n"
+            b"UID:uid1\r\n"
+            b"DTSTART:20130621T120000Z\r\n"
+            b"ORGANIZER;CN=John Doe:MAILTO:john.doe@example.com\r\n"
+            b"SUMMARY:Foo\r\n"
+            b"END:VEVENT\r\n",
+            out.getvalue())
+
+    def test_render_requires_a_value_per_slot(self):
+        writer = CalendarWriter(six.BytesIO())
+
+        self.assertRaises(ValueError, writer.render, self.template, "uid1")
+
+    def render_rows(self, rows, **kwargs):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, **kwargs)
+        for row in rows:
+            writer.render(self.template, *row)
+        return out.getvalue()
+
+    def test_render_columns_matches_render(self):
+        rows = [("uid{}".format(n), self.start + datetime.timedelta(days=n),
+                 "A long, folded summary; " * n) for n in range(5)]
+        for line_length in [75, 10]:
+            out = six.BytesIO()
+            writer = CalendarWriter(out, line_length=line_length)
+            self.assertEqual(5, writer.render_columns(
+                self.template, *zip(*rows), batch_size=2))
+            self.assertEqual(self.render_rows(rows, line_length=line_length),
+                             out.getvalue())
+
+    @unittest.skipIf(numpy is None, "NumPy isn't installed")
+    def test_render_columns_numpy_timestamps(self):
+        template = ComponentTemplate("VEVENT")
+        template.slot("DTSTART", "as_timestamp")
+        starts = [-86401, 0, 951782400, 1371812400, 4107542399]
+
+        for column in [numpy.array(starts, dtype=numpy.int64),
+                       numpy.array(starts, dtype="datetime64[s]")]:
+            expected, actual = six.BytesIO(), six.BytesIO()
+            for start in starts:
+                CalendarWriter(expected).render(template, start)
+            CalendarWriter(actual).render_columns(template, column)
+            self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_render_columns_requires_a_column_per_slot(self):
+        writer = CalendarWriter(six.BytesIO())
+
+        self.assertRaises(ValueError, writer.render_columns, self.template,
+                          ["uid1"])
+
+
+def render_cached_event(writer, uid, summary):
+    writer.begin("VEVENT")
+    writer.contentline("UID", uid)
+    writer.contentline("SUMMARY", writer.as_text(summary))
+    writer.end("VEVENT")
+
+
+class TestComponentCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "components.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_capture(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, buffer_size=1)
+        octets = writer.capture(render_cached_event, "1", "a, b")
+        self.assertEqual(b"BEGIN:VEVENT\r\nUID:1\r\nSUMMARY:a\\, b\r\n"
+                         b"END:VEVENT\r\n", octets)
+        self.assertEqual(b"", out.getvalue())
+
+    def test_render_cached(self):
+        cache = ComponentCache()
+        render = MagicMock(side_effect=render_cached_event)
+        expected = six.BytesIO()
+        render_cached_event(CalendarWriter(expected), "1", "Summary")
+
+        for _ in range(2):
+            out = six.BytesIO()
+            CalendarWriter(out).render_cached(
+                cache, ("1", 0), render, "1", "Summary")
+            self.assertEqual(expected.getvalue(), out.getvalue())
+
+        render.assert_called_once_with(ANY, "1", "Summary")
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def test_components_are_stored(self):
+        with ComponentCache(path=self.path) as cache:
+            cache[("1", 0)] = b"octets"
+
+        with ComponentCache(path=self.path) as cache:
+            self.assertEqual(b"octets", cache.get(("1", 0)))
+            self.assertIsNone(cache.get(("1", 1)))
+            self.assertEqual(hashlib.sha256(b"octets").digest(),
+                             cache.digest(("1", 0)))
+
+    def test_least_recently_used_components_are_discarded(self):
+        with ComponentCache(path=self.path, max_stored=2) as cache:
+            cache["a"] = b"a"
+            cache["b"] = b"b"
+            cache["c"] = b"c"
+            cache.get("a")
+
+        with ComponentCache(path=self.path) as cache:
+            self.assertEqual([b"a", None, b"c"],
+                             [cache.get(k) for k in "abc"])
+
+
+class TestFanOut(unittest.TestCase):
+    def setUp(self):
+        self.outputs = dict((name, six.BytesIO()) for name in "abc")
+        self.fan_out = FanOut(dict(
+            (name, CalendarWriter(out))
+            for name, out in six.iteritems(self.outputs)))
+
+    def test_components_are_rendered_once(self):
+        render = MagicMock(side_effect=render_cached_event)
+        octets = self.fan_out.component(["a", "c"], render, "1", "Summary")
+
+        render.assert_called_once_with(ANY, "1", "Summary")
+        self.assertEqual(
+            {"a": octets, "b": b"", "c": octets},
+            dict((name, out.getvalue())
+                 for name, out in six.iteritems(self.outputs)))
+
+    def test_render_to_every_feed(self):
+        template = ComponentTemplate("VEVENT")
+        template.slot("UID")
+        octets = self.fan_out.render(None, template, "1")
+
+        self.assertEqual(b"BEGIN:VEVENT\r\nUID:1\r\nEND:VEVENT\r\n", octets)
+        for out in six.itervalues(self.outputs):
+            self.assertEqual(octets, out.getvalue())
+
+    def test_writers_must_have_the_same_line_length(self):
+        with self.assertRaises(ValueError):
+            FanOut({"a": CalendarWriter(six.BytesIO(), line_length=10)})
+
+
+class TestHashing(unittest.TestCase):
+    def test_hashing_output(self):
+        chunks = []
+        out = MagicMock(write=MagicMock(side_effect=chunks.append))
+        hashing = HashingOutput(out, "md5")
+        writer = CalendarWriter(hashing, buffer_size=16)
+        for uid in ["1", "2"]:
+            render_cached_event(writer, uid, "Summary")
+        writer.close()
+
+        out.close.assert_called_once_with()
+        self.assertEqual(hashlib.md5(b"".join(chunks)).hexdigest(),
+                         hashing.digest)
+        self.assertEqual(len(b"".join(chunks)), hashing.length)
+
+    def test_feed_digest_from_cached_digests(self):
+        cache = ComponentCache()
+        writer = CalendarWriter(six.BytesIO())
+        rendered = FeedDigest()
+        for uid in ["1", "2"]:
+            writer.render_cached(cache, (uid, 0), render_cached_event, uid,
+                                 "Summary")
+            rendered.add_digest(cache.digest((uid, 0)))
+
+        from_cache = FeedDigest()
+        for uid in ["1", "2"]:
+            from_cache.add(cache.get((uid, 0)))
+
+        self.assertEqual(rendered.etag(), from_cache.etag())
+        self.assertEqual('"{}"'.format(rendered.hexdigest()),
+                         rendered.etag())
+        self.assertIsNone(cache.digest(("3", 0)))
+
+
+class TestComponentIndex(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "calendar.ics")
+        self.index_path = self.path + ".idx"
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_calendar(self, uids, **kwargs):
+        index = ComponentIndex()
+        with open(self.path, "wb") as f:
+            writer = CalendarWriter(f, **kwargs)
+            writer.begin("VCALENDAR")
+            for uid in uids:
+                with writer.indexed(index, uid):
+                    render_cached_event(writer, uid, "Event " + uid)
+            writer.end("VCALENDAR")
+            writer.flush()
+        index.save(self.index_path)
+        return index
+
+    def test_tell(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, buffer_size=100)
+        writer.contentline("UID", "1")
+        self.assertEqual(b"", out.getvalue())
+        self.assertEqual(7, writer.tell())
+
+    def test_components_are_found_by_uid(self):
+        uids = ["{}@example.com".format(n) for n in range(100)] + ["\xe9"]
+        self.write_calendar(uids, buffer_size=256)
+
+        with IndexedCalendar(self.path, self.index_path) as calendar:
+            self.assertEqual(len(uids), len(calendar))
+            for uid in uids:
+                expected = CalendarWriter(six.BytesIO()).capture(
+                    render_cached_event, uid, "Event " + uid)
+                self.assertEqual(expected, calendar[uid])
+            self.assertNotIn("missing", calendar)
+            self.assertIsNone(calendar.get("missing"))
+            with self.assertRaises(KeyError):
+                calendar["missing"]
+
+    def test_empty_index(self):
+        self.write_calendar([])
+        with IndexedCalendar(self.path, self.index_path) as calendar:
+            self.assertEqual(0, len(calendar))
+            self.assertNotIn("1", calendar)
+
+    def test_not_an_index_raises_value_error(self):
+        self.write_calendar(["1"])
+        with self.assertRaises(ValueError):
+            IndexedCalendar(self.path, self.path)
+
+
+class TestFileDescriptorOutput(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "calendar.ics")
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def test_writes_are_batched(self):
+        out = FileDescriptorOutput(self.fd, batch_size=10)
+        out.write(b"12345")
+        self.assertEqual(b"", self.read())
+        out.write(b"67890")
+        self.assertEqual(b"1234567890", self.read())
+        out.write(b"1")
+        self.assertEqual(11, out.tell())
+        out.close()
+        self.assertEqual(b"12345678901", self.read())
+
+    def test_buffers_per_writev_are_limited(self):
+        def write(fd, buffers):
+            return os.write(fd, b"".join(buffers))
+
+        with patch("llic._writev", side_effect=write) as writev:
+            out = FileDescriptorOutput(self.fd, max_iovecs=2)
+            for octets in [b"a", b"b", b"c"]:
+                out.write(octets)
+            out.close()
+        self.assertEqual([((self.fd, [b"a", b"b"]),), ((self.fd, [b"c"]),)],
+                         writev.call_args_list)
+        self.assertEqual(b"abc", self.read())
+
+    def test_partial_writes(self):
+        def writev(fd, buffers):
+            return os.write(fd, b"".join(buffers)[:3])
+
+        with patch("llic._writev", side_effect=writev):
+            out = FileDescriptorOutput(self.fd)
+            for octets in [b"12", b"345", b"6789"]:
+                out.write(octets)
+            out.close()
+        self.assertEqual(b"123456789", self.read())
+
+    def test_sendfile(self):
+        source = os.path.join(self.tempdir, "source")
+        with open(source, "wb") as f:
+            f.write(b"0123456789")
+
+        writer = CalendarWriter(FileDescriptorOutput(self.fd))
+        writer.write_raw(b"a")
+        with open(source, "rb") as f:
+            writer.write_file(f, 2, 3)
+            writer.write_file(f, 8)
+        writer.write_raw(b"b")
+        self.assertEqual(7, writer.tell())
+        writer.close()
+        self.assertEqual(b"a23489b", self.read())
+
+    def test_write_file_without_sendfile(self):
+        os.close(self.fd)
+        out = six.BytesIO()
+        writer = CalendarWriter(out, buffer_size=4)
+        writer.write_file(six.BytesIO(b"0123456789"), 2, 5)
+        writer.write_file(six.BytesIO(b"0123456789"), 8)
+        writer.flush()
+        self.assertEqual(b"2345689", out.getvalue())
+
+
+class TestUnfoldLines(unittest.TestCase):
+    def test_folded_lines_are_unfolded(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out)
+        summary = "Lorem ipsum dolor sit amet, " * 20
+        writer.contentline("SUMMARY", summary)
+        writer.contentline("UID", "1")
+
+        for read_size in [1, 7, 1024]:
+            lines = list(unfold_lines(six.BytesIO(out.getvalue()),
+                                      read_size=read_size))
+
+            self.assertEqual(
+                [b"SUMMARY:" + summary.encode("utf-8"), b"UID:1"], lines)
+
+    def test_lf_line_endings_and_tab_folds(self):
+        stream = six.BytesIO(b"SUMMARY:Foo\n\tbar\nUID:1")
+
+        self.assertEqual([b"SUMMARY:Foobar", b"UID:1"],
+                         list(unfold_lines(stream)))
+
+    def test_blank_lines_are_ignored(self):
+        stream = six.BytesIO(b"\r\nUID:1\r\n\r\n")
+
+        self.assertEqual([b"UID:1"], list(unfold_lines(stream)))
+
+
+class TestParseContentline(unittest.TestCase):
+    def test_name_and_value(self):
+        self.assertEqual((b"UID", [], b"uid1@example.com"),
+                         parse_contentline(b"UID:uid1@example.com"))
+
+    def test_params(self):
+        self.assertEqual(
+            (b"ORGANIZER", [(b"CN", b"John Doe"), (b"ROLE", b"CHAIR")],
+             b"MAILTO:john.doe@example.com"),
+            parse_contentline(
+                b"ORGANIZER;CN=John Doe;ROLE=CHAIR:"
+                b"MAILTO:john.doe@example.com"))
+
+    def test_quoted_and_multi_valued_params(self):
+        self.assertEqual(
+            (b"ATTENDEE",
+             [(b"DELEGATED-FROM", b'"mailto:a@example.com",'
+                                  b'"mailto:b@example.com"'),
+              (b"CN", b'"Doe; John"')],
+             b"mailto:c@example.com"),
+            parse_contentline(
+                b'ATTENDEE;DELEGATED-FROM="mailto:a@example.com",'
+                b'"mailto:b@example.com";CN="Doe; John":'
+                b"mailto:c@example.com"))
+
+    def test_missing_value_raises_value_error(self):
+        self.assertRaises(ValueError, parse_contentline, b"UID")
+
+    def test_invalid_param_raises_value_error(self):
+        self.assertRaises(ValueError, parse_contentline, b"UID;X:1")
+
+
+class TestReadContentlines(unittest.TestCase):
+    def test_read_written_calendar(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out)
+        writer.begin("VCALENDAR")
+        writer.contentline("ORGANIZER;CN=John Doe",
+                           "MAILTO:john.doe@example.com")
+        writer.end("VCALENDAR")
+
+        self.assertEqual(
+            [(b"BEGIN", [], b"VCALENDAR"),
+             (b"ORGANIZER", [(b"CN", b"John Doe")],
+              b"MAILTO:john.doe@example.com"),
+             (b"END", [], b"VCALENDAR")],
+            list(read_contentlines(six.BytesIO(out.getvalue()))))
+
+
+class TestIterChunks(unittest.TestCase):
+    def render(self, writer, steps):
+        writer.begin("VCALENDAR")
+        for i in range(100):
+            writer.contentline("UID", "uid{}@example.com".format(i))
+            steps.append(i)
+            yield
+        writer.end("VCALENDAR")
+
+    def expected(self):
+        out = six.BytesIO()
+        for _ in self.render(CalendarWriter(out), []):
+            pass
+        return out.getvalue()
+
+    def test_chunks_are_generated_incrementally(self):
+        steps = []
+        chunks = iter_chunks(lambda writer: self.render(writer, steps),
+                             chunk_size=100)
+
+        first = next(chunks)
+        self.assertTrue(100 <= len(first) < 200)
+        self.assertTrue(len(steps) < 10)
+
+        self.assertEqual(self.expected(), first + b"".join(chunks))
+
+    def test_render_function_without_steps(self):
+        def render(writer):
+            for _ in self.render(writer, []):
+                pass
+
+        chunks = list(iter_chunks(render, chunk_size=100))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(self.expected(), b"".join(chunks))
+
+    def test_writer_arguments(self):
+        chunks = iter_chunks(
+            lambda writer: writer.contentline("SUMMARY", "Foo bar baz"),
+            line_length=10)
+
+        self.assertEqual([b"SUMMARY:Fo\r\n o bar baz\r\n"], list(chunks))
+
+
+class TestCompressedOutput(unittest.TestCase):
+    def write_calendar(self, writer):
+        writer.begin("VCALENDAR")
+        for i in range(100):
+            writer.contentline("UID", "uid{}@example.com".format(i))
+        writer.end("VCALENDAR")
+
+    def expected(self):
+        out = six.BytesIO()
+        self.write_calendar(CalendarWriter(out))
+        return out.getvalue()
+
+    def test_gzip(self):
+        out = MagicMock(wraps=six.BytesIO())
+        writer = CalendarWriter(CompressedOutput(out), buffer_size=1024)
+        self.write_calendar(writer)
+        writer.flush()
+
+        self.assertTrue(out.write.call_count <= 2)
+        writer.close()
+        out.close.assert_called_once_with()
+        compressed = b"".join(c[0][0] for c in out.write.call_args_list)
+        self.assertEqual(
+            self.expected(),
+            gzip.GzipFile(fileobj=six.BytesIO(compressed)).read())
+
+    def test_deflate(self):
+        chunks = []
+        out = MagicMock()
+        out.write.side_effect = chunks.append
+        writer = CalendarWriter(CompressedOutput(out, "deflate", level=9))
+        self.write_calendar(writer)
+        writer.close()
+
+        self.assertEqual(self.expected(), zlib.decompress(b"".join(chunks)))
+
+    def test_sync_flush_mode(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(
+            CompressedOutput(out, "raw", flush_mode=zlib.Z_SYNC_FLUSH))
+        writer.contentline("UID", "1")
+
+        self.assertEqual(
+            b"UID:1\r\n",
+            zlib.decompressobj(-zlib.MAX_WBITS).decompress(out.getvalue()))
+
+    def test_unknown_format_raises_value_error(self):
+        self.assertRaises(ValueError, CompressedOutput, six.BytesIO(), "foo")
+
+    def test_iter_chunks_compression(self):
+        chunks = iter_chunks(self.write_calendar, compression="gzip")
+
+        self.assertEqual(
+            self.expected(),
+            gzip.GzipFile(fileobj=six.BytesIO(b"".join(chunks))).read())
+
+
+class TestInstrumentedCalendarWriter(unittest.TestCase):
+    start = pytz.utc.localize(datetime.datetime(2013, 6, 21, 12, 0))
+
+    def write_event(self, writer):
+        writer.begin("VEVENT")
+        writer.contentline("DTSTART", writer.as_datetime(self.start))
+        writer.contentline("DTEND", writer.as_datetime(self.start))
+        writer.contentline("SUMMARY", writer.as_text("Foo " * 30))
+        writer.contentline("ORGANIZER", "MAILTO:a@example.com",
+                           {"CN": "A"})
+        writer.end("VEVENT")
+
+    def test_counters(self):
+        out = six.BytesIO()
+        writer = InstrumentedCalendarWriter(out)
+        self.write_event(writer)
+
+        stats = writer.stats()
+        self.assertEqual(len(out.getvalue()), stats["octets"])
+        self.assertTrue(stats["output_writes"] > 6)
+        self.assertEqual(6, stats["contentlines"])
+        self.assertEqual(1, stats["folds"])
+        self.assertEqual(1, stats["as_text"])
+        self.assertEqual(2, stats["as_datetime"])
+        self.assertEqual(1, stats["datetime_cache_hits"])
+        self.assertEqual(1, stats["param_cache_misses"])
+
+    def test_buffered_counters(self):
+        out = six.BytesIO()
+        writer = InstrumentedCalendarWriter(out, buffer_size=1024)
+        self.write_event(writer)
+        writer.flush()
+
+        stats = writer.stats()
+        self.assertEqual(len(out.getvalue()), stats["octets"])
+        self.assertEqual(1, stats["output_writes"])
+
+    def test_output_matches_uninstrumented_writer(self):
+        expected, actual = six.BytesIO(), six.BytesIO()
+        self.write_event(CalendarWriter(expected))
+        self.write_event(InstrumentedCalendarWriter(actual, timing=True))
+
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+
+    def test_text_cache_stats(self):
+        writer = InstrumentedCalendarWriter(six.BytesIO(),
+                                            text_cache=LRUCache())
+        writer.as_text("Foo")
+        writer.as_text("Foo")
+
+        self.assertEqual(1, writer.stats()["text_cache_hits"])
+
+    def test_timing(self):
+        callback = MagicMock()
+        writer = InstrumentedCalendarWriter(six.BytesIO(),
+                                            timing_callback=callback)
+        writer.as_text("Foo")
+
+        callback.assert_called_once_with("as_text", ANY)
+        stats = writer.stats()
+        self.assertTrue(stats["time_as_text"] > 0)
+        self.assertEqual(0, stats["time_as_datetime"])
+
+    def test_timing_is_disabled_by_default(self):
+        stats = InstrumentedCalendarWriter(six.BytesIO()).stats()
+
+        self.assertNotIn("time_as_text", stats)
+
+
+class TestValidatingCalendarWriter(unittest.TestCase):
+    def setUp(self):
+        self.out = six.BytesIO()
+        self.writer = ValidatingCalendarWriter(self.out)
+
+    def begin_calendar(self):
+        self.writer.begin("VCALENDAR")
+        self.writer.contentline("VERSION", "2.0")
+        self.writer.contentline("PRODID", "-//Example//EN")
+
+    def write_event(self):
+        self.writer.begin("VEVENT")
+        self.writer.contentline("UID", "1")
+        self.writer.contentline("DTSTAMP", "20130621T120000Z")
+        self.writer.end("VEVENT")
+
+    def test_valid_calendar(self):
+        self.begin_calendar()
+        self.write_event()
+        self.writer.end("VCALENDAR")
+
+        expected = six.BytesIO()
+        writer = CalendarWriter(expected)
+        writer.begin("VCALENDAR")
+        writer.contentline("VERSION", "2.0")
+        writer.contentline("PRODID", "-//Example//EN")
+        writer.begin("VEVENT")
+        writer.contentline("UID", "1")
+        writer.contentline("DTSTAMP", "20130621T120000Z")
+        writer.end("VEVENT")
+        writer.end("VCALENDAR")
+        self.assertEqual(expected.getvalue(), self.out.getvalue())
+        self.writer.close()
+
+    def test_mismatched_end(self):
+        self.begin_calendar()
+        self.writer.begin("VEVENT")
+
+        self.assertRaises(ValidationError, self.writer.end, "VCALENDAR")
+
+    def test_end_without_begin(self):
+        self.assertRaises(ValidationError, self.writer.end, "VCALENDAR")
+
+    def test_invalid_nesting(self):
+        self.assertRaises(ValidationError, self.writer.begin, "VEVENT")
+        self.begin_calendar()
+        self.assertRaises(ValidationError, self.writer.begin, "VALARM")
+        self.assertRaises(ValidationError, self.writer.begin, "VCALENDAR")
+
+    def test_experimental_components_are_allowed(self):
+        self.begin_calendar()
+        self.writer.begin("X-FOO")
+        self.writer.end("X-FOO")
+
+    def test_property_outside_vcalendar(self):
+        self.assertRaises(ValidationError, self.writer.contentline,
+                          "VERSION", "2.0")
+
+    def test_missing_required_properties(self):
+        self.begin_calendar()
+        self.writer.begin("VEVENT")
+        self.writer.contentline("UID", "1")
+
+        try:
+            self.writer.end("VEVENT")
+            self.fail()
+        except ValidationError as e:
+            self.assertIn("DTSTAMP", str(e))
+
+    def test_required_property_names_are_case_insensitive(self):
+        self.begin_calendar()
+        self.writer.begin("VEVENT")
+        self.writer.contentline("uid", "1")
+        self.writer.start_contentline("Dtstamp")
+        self.writer.value("20130621T120000Z")
+        self.writer.end_contentline()
+        self.writer.end("VEVENT")
+        self.writer.end("VCALENDAR")
+
+    def test_required_properties_of_enclosing_component(self):
+        self.writer.begin("VCALENDAR")
+        self.writer.contentline("VERSION", "2.0")
+        self.write_event()
+
+        self.assertRaises(ValidationError, self.writer.end, "VCALENDAR")
+
+    def test_end_contentline_without_value(self):
+        self.begin_calendar()
+        self.writer.start_contentline("SUMMARY")
+
+        self.assertRaises(ValidationError, self.writer.end_contentline)
+
+    def test_start_contentline_within_contentline(self):
+        self.begin_calendar()
+        self.writer.start_contentline("SUMMARY")
+
+        self.assertRaises(ValidationError, self.writer.start_contentline,
+                          "UID")
+
+    def test_value_outside_contentline(self):
+        self.begin_calendar()
+
+        self.assertRaises(ValidationError, self.writer.value, "foo")
+
+    def test_close_with_open_components(self):
+        self.begin_calendar()
+
+        self.assertRaises(ValidationError, self.writer.close)
+
+    def test_render(self):
+        template = ComponentTemplate("VEVENT")
+        template.slot("UID")
+        self.begin_calendar()
+
+        self.assertRaises(ValidationError, self.writer.render, template, "1")
+
+        template.contentline("DTSTAMP", "20130621T120000Z")
+        self.writer.render(template, "1")
+        self.writer.end("VCALENDAR")
+
+    def test_render_columns(self):
+        template = ComponentTemplate("VEVENT")
+        template.slot("UID")
+        self.begin_calendar()
+
+        self.assertRaises(ValidationError, self.writer.render_columns,
+                          template, ["1", "2"])
+
+        template.contentline("DTSTAMP", "20130621T120000Z")
+        self.writer.render_columns(template, ["1", "2"])
+        self.writer.end("VCALENDAR")
+
+
+def render_event(writer, uid):
+    writer.begin("VEVENT")
+    writer.contentline("UID", uid)
+    writer.contentline("SUMMARY", writer.as_text("Lorem ipsum, " * 10))
+    writer.end("VEVENT")
+
+
+def render_header(writer):
+    writer.contentline("VERSION", "2.0")
+
+
+@unittest.skipIf(futures is None, "concurrent.futures is not available")
+class TestRenderParallel(unittest.TestCase):
+    uids = ["uid{}@example.com".format(i) for i in range(50)]
+
+    def expected(self, line_length=75):
+        out = six.BytesIO()
+        writer = CalendarWriter(out, line_length=line_length)
+        writer.begin("VCALENDAR")
+        render_header(writer)
+        for uid in self.uids:
+            render_event(writer, uid)
+        writer.end("VCALENDAR")
+        return out.getvalue()
+
+    def test_output_is_in_order(self):
+        with futures.ThreadPoolExecutor(4) as executor:
+            chunks = list(render_parallel(
+                self.uids, render_event, header=render_header, batch_size=7,
+                executor=executor, max_pending=3))
+
+        # header, 8 batches, footer
+        self.assertEqual(10, len(chunks))
+        self.assertEqual(self.expected(), b"".join(chunks))
+
+    def test_writer_arguments_are_used(self):
+        with futures.ThreadPoolExecutor(2) as executor:
+            chunks = render_parallel(
+                self.uids, render_event, header=render_header,
+                executor=executor, line_length=40)
+
+            self.assertEqual(self.expected(40), b"".join(chunks))
+
+    def test_buffered_writers_are_flushed(self):
+        with futures.ThreadPoolExecutor(2) as executor:
+            chunks = render_parallel(
+                self.uids, render_event, header=render_header,
+                executor=executor, buffer_size=4096)
+
+            self.assertEqual(self.expected(), b"".join(chunks))
+
+    def test_process_pool(self):
+        chunks = render_parallel(self.uids, render_event,
+                                 header=render_header, batch_size=10,
+                                 max_workers=2)
+
+        self.assertEqual(self.expected(), b"".join(chunks))
+
+
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class TestAsyncCalendarWriter(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.messages = []
+
+    def tearDown(self):
+        self.loop.close()
+
+    def await_(self, awaitable):
+        return self.loop.run_until_complete(asyncio.ensure_future(
+            awaitable, loop=self.loop))
+
+    def send(self, message):
+        self.messages.append(message)
+        return asyncio.sleep(0)
+
+    def write_events(self, writer, count, drain=lambda: None):
+        writer.begin("VCALENDAR")
+        for i in range(count):
+            writer.begin("VEVENT")
+            writer.contentline("UID", "uid{}@example.com".format(i))
+            writer.contentline("SUMMARY", writer.as_text("Foo " * 30))
+            writer.end("VEVENT")
+            drain()
+        writer.end("VCALENDAR")
+
+    def test_asgi_output_matches_sync_writer(self):
+        expected = six.BytesIO()
+        self.write_events(CalendarWriter(expected), 20)
+
+        writer = AsyncCalendarWriter(self.send, chunk_size=256)
+        self.write_events(writer, 20,
+                          lambda: self.await_(writer.drain()))
+        self.await_(writer.close())
+
+        self.assertEqual(expected.getvalue(),
+                         b"".join(m["body"] for m in self.messages))
+        self.assertTrue(len(self.messages) > 2)
+        self.assertTrue(all(m["more_body"] for m in self.messages[:-1]))
+        self.assertFalse(self.messages[-1]["more_body"])
+
+    def test_drain_sends_nothing_below_chunk_size(self):
+        writer = AsyncCalendarWriter(self.send)
+        writer.contentline("UID", "1")
+
+        self.await_(writer.drain())
+
+        self.assertEqual([], self.messages)
+
+    def test_stream_writer_output(self):
+        stream = MagicMock()
+        stream.drain.side_effect = lambda: asyncio.sleep(0)
+        writer = AsyncCalendarWriter(stream, chunk_size=8)
+
+        writer.contentline("UID", "1")
+        writer.contentline("UID", "2")
+        self.await_(writer.drain())
+
+        stream.write.assert_called_once_with(b"UID:1\r\nUID:2\r\n")
+
+    def test_async_context_manager(self):
+        def use_writer():
+            return AsyncCalendarWriter(self.send).__aenter__()
+
+        writer = self.await_(use_writer())
+        writer.contentline("UID", "1")
+        self.await_(writer.__aexit__(None, None, None))
+
+        self.assertEqual(
+            [{"type": "http.response.body", "body": b"UID:1\r\n",
+              "more_body": False}],
+            self.messages)
+
+    def test_unsupported_output_raises_type_error(self):
+        self.assertRaises(TypeError, AsyncCalendarWriter, object())
+
+
+class TestMergeCalendars(unittest.TestCase):
+    timezone = (
+        b"BEGIN:VTIMEZONE\r\nTZID:Europe/London\r\n"
+        b"BEGIN:STANDARD\r\nDTSTART:16010101T000000\r\n"
+        b"TZOFFSETFROM:+0000\r\nTZOFFSETTO:+0000\r\nEND:STANDARD\r\n"
+        b"END:VTIMEZONE\r\n")
+
+    def event(self, uid, summary, *lines):
+        return b"".join(
+            [b"BEGIN:VEVENT\r\nUID:" + uid + b"\r\n"] +
+            [line + b"\r\n" for line in lines] +
+            [b"SUMMARY:" + summary + b"\r\nEND:VEVENT\r\n"])
+
+    def calendar(self, *components):
+        return (b"BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Source//EN\r\n" +
+                b"".join(components) + b"END:VCALENDAR\r\n")
+
+    def merge(self, *sources):
+        out = six.BytesIO()
+        merge_calendars(sources, CalendarWriter(out),
+                        [("VERSION", "2.0"), ("PRODID", "-//Merged//EN")])
+        return out.getvalue()
+
+    def test_components_are_copied(self):
+        a = self.event(b"1", b"A", b"SEQUENCE:1")
+        b = self.event(b"2", b"B")
+        todo = b"BEGIN:VTODO\r\nUID:3\r\nEND:VTODO\r\n"
+        self.assertEqual(
+            self.calendar(a, b, todo).replace(b"Source", b"Merged"),
+            self.merge(self.calendar(a), self.calendar(b, todo)))
+
+    def test_latest_version_is_kept(self):
+        old = self.event(b"1", b"Old", b"SEQUENCE:1")
+        new = self.event(b"1", b"New", b"SEQUENCE:2")
+        modified = self.event(b"2", b"Modified",
+                              b"LAST-MODIFIED:20150102T000000Z")
+        unmodified = self.event(b"2", b"Unmodified",
+                                b"LAST-MODIFIED:20150101T000000Z")
+        merged = self.merge(self.calendar(old, modified),
+                            self.calendar(new, unmodified))
+        self.assertEqual([b"Modified", b"New"],
+                         re.findall(b"SUMMARY:(.*)\r", merged))
+
+    def test_recurrence_instances_are_kept(self):
+        event = self.event(b"1", b"Event")
+        instance = self.event(b"1", b"Instance",
+                              b"RECURRENCE-ID:20150101T000000Z")
+        merged = self.merge(self.calendar(event), self.calendar(instance))
+        self.assertEqual([b"Event", b"Instance"],
+                         re.findall(b"SUMMARY:(.*)\r", merged))
+
+    def test_folded_properties_and_subcomponents(self):
+        alarm = b"BEGIN:VALARM\r\nUID:alarm\r\nEND:VALARM"
+        event = self.event(b"long\r\n uid", b"Event", alarm)
+        duplicate = self.event(b"longuid", b"Duplicate")
+        merged = self.merge(self.calendar(event, duplicate))
+        self.assertEqual([b"Event"], re.findall(b"SUMMARY:(.*)\r", merged))
+        self.assertIn(alarm, merged)
+
+    def test_timezones_are_merged(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "calendar.ics")
+            with open(path, "wb") as f:
+                f.write(self.calendar(self.timezone, self.event(b"2", b"B")))
+
+            merged = self.merge(
+                self.calendar(self.event(b"1", b"A"), self.timezone), path)
+        finally:
+            shutil.rmtree(tempdir)
+
+        self.assertEqual(1, merged.count(b"BEGIN:VTIMEZONE"))
+        self.assertTrue(merged.index(b"VTIMEZONE") < merged.index(b"UID:1"))
+
+
+class TestLint(unittest.TestCase):
+    invalid = (
+        b"BEGIN:VCALENDAR\r\n"
+        b"SUMMARY:" + b"x" * 70 + b"\r\n"
+        b"DESCRIPTION:caf\xc3\r\n \xa9\r\n"
+        b"\r\n"
+        b"X:a\rb\nc\x01\r\n"
+        b"Y:\xff\r\n"
+        b"END:VEVENT\r\n")
+
+    expected = [
+        (17, "Line longer than 75 octets"),
+        (113, "Fold splits a multi-octet UTF-8 sequence"),
+        (119, "Empty line"),
+        (124, "Bare CR"),
+        (126, "Bare LF"),
+        (128, "Control character"),
+        (133, "Invalid UTF-8"),
+        (136, "END:VEVENT without BEGIN:VEVENT"),
+        (148, "BEGIN:VCALENDAR not ended"),
+    ]
+
+    def test_valid_calendar(self):
+        out = six.BytesIO()
+        writer = CalendarWriter(out)
+        writer.begin("VCALENDAR")
+        render_cached_event(writer, "1", "\u6771\u4eac\u5927\u5b66 " * 20)
+        writer.end("VCALENDAR")
+
+        self.assertEqual([], lint(out.getvalue()))
+
+    def test_problems(self):
+        self.assertEqual(self.expected, lint(self.invalid))
+
+    def test_problems_spanning_chunks(self):
+        for chunk_size in range(1, 40):
+            self.assertEqual(self.expected,
+                             lint(self.invalid, chunk_size=chunk_size))
+
+    def test_long_lines_without_crlf(self):
+        self.assertEqual([(5, "Line longer than 10 octets")],
+                         lint(b"X:1\r\n" + b"x" * 11, line_length=10))
+        self.assertEqual([(5, "Line longer than 10 octets"), (16, "Bare LF")],
+                         lint(b"X:1\r\n" + b"x" * 11 + b"\n",
+                              line_length=10))
+        self.assertEqual([], lint(b"X:1\r\n" + b"x" * 10 + b"\r\n",
+                                  line_length=10))
+
+    def test_component_names_are_case_insensitive(self):
+        self.assertEqual([], lint(
+            b"BEGIN:VCALENDAR\r\n"
+            b"begin:vevent\r\n"
+            b"END:VEVENT\r\n"
+            b"Begin:VTodo\r\n"
+            b"end:VTODO\r\n"
+            b"End:vcalendar\r\n"))
+
+    def test_unmatched_ends_dont_cascade(self):
+        self.assertEqual([
+            (31, "BEGIN:VEVENT not ended"),
+            (46, "END:VTODO without BEGIN:VTODO"),
+        ], lint(
+            b"BEGIN:VCALENDAR\r\n"
+            b"BEGIN:VEVENT\r\n"
+            b"END:VCALENDAR\r\n"
+            b"END:VTODO\r\n"))
+
+    def test_invalid_utf8_runs(self):
+        data = b"X:" + b"a\xff" * 1000 + b"\xfe\r\n a\xff\xff\r\n"
+        expected = [(3 + 2 * i, "Invalid UTF-8") for i in range(1000)]
+        expected.append((2007, "Invalid UTF-8"))
+        self.assertEqual(expected, lint(data, line_length=4096))
+
+    def test_lf_line_endings_are_chunk_boundaries(self):
+        data = (b"X:" + b"y" * 8 + b"\n") * 10
+        chunks = list(_lint_chunks(data, 25))
+        self.assertEqual(data, b"".join(chunk for offset, chunk in chunks))
+        self.assertEqual(5, len(chunks))
+        self.assertLessEqual(max(len(chunk) for offset, chunk in chunks), 25)
+        self.assertEqual([(10 + 11 * i, "Bare LF") for i in range(10)],
+                         lint(data, chunk_size=25))
+
+    def test_start_of_file(self):
+        self.assertEqual([(0, "Fold at start of file")], lint(b" x\r\n"))
+        self.assertEqual([(0, "Empty line")], lint(b"\r\nX:1\r\n"))
+        self.assertEqual([(0, "Line longer than 10 octets")],
+                         lint(b"X:" + b"x" * 9 + b"\r\n", line_length=10))
+        self.assertEqual([], lint(b""))
+
+    def test_lint_main(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "calendar.ics")
+            with open(path, "wb") as f:
+                f.write(b"X:a\n")
+
+            with patch("sys.stdout", new_callable=six.StringIO) as stdout:
+                self.assertEqual(1, lint_main([path]))
+            self.assertEqual("{}:3: Bare LF\n".format(path),
+                             stdout.getvalue())
+
+            with open(path, "wb") as f:
+                f.write(b"X:a\r\n")
+            self.assertEqual(0, lint_main([path]))
+        finally:
+            shutil.rmtree(tempdir)